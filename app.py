@@ -1,15 +1,31 @@
 import os
 from datetime import datetime, timedelta
 from functools import wraps
+from types import SimpleNamespace
 
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, jsonify, make_response, abort
+    session, flash, jsonify, make_response, abort, Response, stream_with_context,
+    send_from_directory
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import table, column, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import csv, io
+import csv, io, base64, re, sqlite3, hashlib, hmac, random, time, uuid
+import click
+
+import audit_archive
+from cache import make_cache
+from audit_sink import AuditSink
+from images import ImagePipeline, VARIANTS, make_variants, variant_path
+from compress import compress_response, SUFFIXES
+from instrumentation import Instrumentation
+from payments import PaymentPipeline, GatewayError, make_gateway, backoff
+import inventory_import
+import queries
+from queries import QueryBudget, query_budget
 
 # ---------- Config ----------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,13 +34,78 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('APP_SECRET', 'bahoNitope')
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(BASE_DIR,'marine_marketplace.db')}"
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(BASE_DIR,'marine_marketplace.db')}")
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):  # Heroku-style URLs
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://' + app.config['SQLALCHEMY_DATABASE_URI'][len('postgres://'):]
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# performance mode: WAL + tuned pragmas on SQLite, sized connection pool on any backend
+app.config['DB_PERFORMANCE_MODE'] = os.environ.get('DB_PERFORMANCE_MODE', '1') == '1'
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': 'WAL',          # readers no longer block on the writer
+    'synchronous': 'NORMAL',        # safe with WAL, one fsync per checkpoint instead of per commit
+    'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -int(os.environ.get('DB_CACHE_KB', 20000)),  # negative = KiB
+    'mmap_size': int(os.environ.get('DB_MMAP_BYTES', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+if app.config['DB_PERFORMANCE_MODE'] and ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),  # per worker process
+        'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW', 10)),
+        'pool_timeout': 30,
+        'pool_pre_ping': not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'),
+        'pool_recycle': 1800,
+    }
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))  # 0 = resize on the request thread
+app.config['CATALOG_PAGE_SIZE'] = int(os.environ.get('CATALOG_PAGE_SIZE', 24))
+REPORT_WINDOWS = (7, 30, 90, 365)  # days selectable on /reports
+app.config['REVIEW_PAGE_SIZE'] = 20
+# read-through cache for product pages: 'memory' (per-process LRU) or 'redis' (CACHE_REDIS_URL)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 60))
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+app.config['RESERVATION_MINUTES'] = int(os.environ.get('RESERVATION_MINUTES', 30))  # unpaid orders hold stock this long
+# audit log writes: 'async' batches them on a background thread, 'sync' writes each one immediately
+app.config['AUDIT_LOG_MODE'] = os.environ.get('AUDIT_LOG_MODE', 'async')
+app.config['AUDIT_BATCH_SIZE'] = int(os.environ.get('AUDIT_BATCH_SIZE', 100))
+app.config['AUDIT_FLUSH_INTERVAL'] = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0))
+app.config['AUDIT_PAGE_SIZE'] = 50
+app.config['PAYMENT_PAGE_SIZE'] = 50
+app.config['IMPORT_MAX_ROWS'] = int(os.environ.get('IMPORT_MAX_ROWS', 10000))
+app.config['IMPORT_BATCH_SIZE'] = 500  # rows per executemany
+app.config['API_MAX_LIMIT'] = 100  # page size and batch lookup cap for /api/v1
+app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 90))
+app.config['AUDIT_ARCHIVE_DIR'] = os.environ.get('AUDIT_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'audit_logs'))
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES', '1') == '1'
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 500))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+# per-request SQL/render timing (Server-Timing header), slow logs and /metrics; off = no hooks installed
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # if set, /metrics needs "Authorization: Bearer <token>"
+# tests/benchmarks: fail any request that runs more SQL statements than this (per-view @query_budget overrides)
+app.config['QUERY_BUDGET'] = int(os.environ['QUERY_BUDGET']) if os.environ.get('QUERY_BUDGET') else None
+# non-COD payments are settled off the request thread through PAYMENT_GATEWAY ('fake' or 'module:Class')
+app.config['PAYMENT_GATEWAY'] = os.environ.get('PAYMENT_GATEWAY', 'fake')
+app.config['PAYMENT_WORKERS'] = int(os.environ.get('PAYMENT_WORKERS', 2))  # 0 = settle on the request thread
+app.config['PAYMENT_MAX_ATTEMPTS'] = int(os.environ.get('PAYMENT_MAX_ATTEMPTS', 5))
+app.config['PAYMENT_WEBHOOK_SECRET'] = os.environ.get('PAYMENT_WEBHOOK_SECRET')  # webhook disabled when unset
 
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_conn, _record):
+    if not isinstance(dbapi_conn, sqlite3.Connection) or not app.config['DB_PERFORMANCE_MODE']:
+        return
+    cur = dbapi_conn.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cur.execute(f'PRAGMA {name}={value}')
+    cur.close()
+
 # ---------- MODELS ----------
 class User(db.Model):
     __tablename__ = 'users'
@@ -46,11 +127,23 @@ class Product(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=0)
     description = db.Column(db.String(400))
     image_path = db.Column(db.String(300))
+    image_variants = db.Column(db.Boolean, default=False)  # resized webp/jpg variants exist for image_path
+    # rating summary, maintained by reviews(); avg kept as a column so the grid can sort/filter on it
+    rating_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
+    rating_avg = db.Column(db.Float, default=0.0)
     vendor_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     vendor = db.relationship('User', backref='products')
 
+    __table_args__ = (
+        db.Index('ix_products_created_id', 'created_at', 'id'),  # keyset pagination
+        db.Index('ix_products_price', 'price'),  # min/max range filters
+        db.Index('ix_products_image_path', 'image_path'),  # upload reference counts
+        db.Index('ix_products_rating', 'rating_avg', 'id'),  # sort/filter by rating
+    )
+
     def __repr__(self):
         return f"<Product {self.name}>"
 
@@ -64,28 +157,38 @@ class Order(db.Model):
     vendor_name = db.Column(db.String(200))
 
     buyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    vendor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # owner of product_id at order time
 
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price_each = db.Column(db.Float, nullable=False, default=0.0)
 
     status = db.Column(db.String(30), default='Pending')  # Pending, Processing, Shipped, Delivered, Cancelled, Paid
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reserved_until = db.Column(db.DateTime, nullable=True)  # stock hold expiry while unpaid; None once paid
 
-    buyer = db.relationship('User', backref='orders')
+    buyer = db.relationship('User', backref='orders', foreign_keys=[buyer_id])
 
     # Relationship to order_items (kept for compatibility but single item expected)
     order_items = db.relationship('OrderItem', backref='order', cascade='all, delete-orphan')
 
     payments = db.relationship('Payment', backref='order', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_orders_created', 'created_at'),  # date-range reports/exports
+        db.Index('ix_orders_vendor_created', 'vendor_id', 'created_at'),  # vendor-scoped views
+        db.Index('ix_orders_buyer_created', 'buyer_id', 'created_at'),  # buyer order/payment history
+        db.Index('ix_orders_reserved_until', 'reserved_until'),  # expired reservation sweep
+    )
+
     def __repr__(self):
         return f"<Order {self.id} product={self.product_name} buyer={self.buyer_id}>"
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_name = db.Column(db.String(200))  # snapshot, survives product deletion
     quantity = db.Column(db.Integer, nullable=False)
     price_each = db.Column(db.Float, nullable=False)
     subtotal = db.Column(db.Float, nullable=False)
@@ -95,6 +198,33 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f"<OrderItem {self.id} order={self.order_id} product={self.product_id}>"
 
+class Cart(db.Model):
+    __tablename__ = 'cart'
+    id = db.Column(db.Integer, primary_key=True)
+    buyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)  # one active cart per buyer
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    items = db.relationship('CartItem', backref='cart', cascade='all, delete-orphan', order_by='CartItem.id')
+
+    def __repr__(self):
+        return f"<Cart {self.id} buyer={self.buyer_id}>"
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_each = db.Column(db.Float, nullable=False)  # price when added; refreshed at checkout
+    subtotal = db.Column(db.Float, nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f"<CartItem {self.id} cart={self.cart_id} product={self.product_id}>"
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     id = db.Column(db.Integer, primary_key=True)
@@ -103,6 +233,17 @@ class Payment(db.Model):
     payment_method = db.Column(db.String(50))
     payment_status = db.Column(db.String(50), default='Pending')  # Pending / Completed / Failed
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64))  # one per payment form submission; also sent to the gateway
+    gateway_ref = db.Column(db.String(100))
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.String(300))
+    settled_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_payments_idempotency_key', 'idempotency_key', unique=True),
+        db.Index('ix_payments_order_date', 'order_id', 'payment_date'),  # payments of an order / buyer / vendor
+        db.Index('ix_payments_date', 'payment_date', 'id'),  # admin history, newest first
+    )
 
     def __repr__(self):
         return f"<Payment {self.id} order={self.order_id} amount={self.amount_paid}>"
@@ -130,6 +271,10 @@ class ProductReview(db.Model):
     user = db.relationship('User')
     product = db.relationship('Product')
 
+    __table_args__ = (
+        db.Index('ix_product_reviews_product_created', 'product_id', 'created_at'),  # paginated review lists
+    )
+
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
     id = db.Column(db.Integer, primary_key=True)
@@ -139,10 +284,189 @@ class AuditLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     actor = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_audit_logs_created', 'created_at'),
+        db.Index('ix_audit_logs_actor_created', 'actor_id', 'created_at'),
+    )
+
+class DailySales(db.Model):
+    """Per-day rollup of order lines by vendor and product, maintained by bump_daily_sales()."""
+    __tablename__ = 'daily_sales'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    vendor_id = db.Column(db.Integer, nullable=False, default=0)  # 0 = unknown / deleted product
+    product_id = db.Column(db.Integer, nullable=False, default=0)
+    product_name = db.Column(db.String(200))
+    order_count = db.Column(db.Integer, nullable=False, default=0)  # all orders placed that day
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)  # delivered orders only
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'vendor_id', 'product_id', name='uq_daily_sales_key'),
+        db.Index('ix_daily_sales_vendor_day', 'vendor_id', 'day'),
+    )
+
+class DataVersion(db.Model):
+    """Change counters ('catalog', 'orders') bumped by write paths; read endpoints derive ETags from them."""
+    __tablename__ = 'data_versions'
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Full-text shadow index over products(name, description), kept in sync by triggers.
+# Not part of db.metadata: created by init_search_index() on SQLite only.
+products_fts = table('products_fts', column('rowid'), column('rank'), column('products_fts'))
+
+PRODUCT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+# eager-loading plan per view: every relationship its template or code walks, loaded with the rows
+queries.plan('orders', db.joinedload(Order.buyer))
+queries.plan('order_lines', db.selectinload(Order.order_items))
+queries.plan('pay', db.selectinload(Order.order_items), db.selectinload(Order.payments))
+queries.plan('product_vendor', db.joinedload(Product.vendor))
+queries.plan('cart', db.selectinload(Cart.items).joinedload(CartItem.product).joinedload(Product.vendor))
+
 # ---------- Helpers ----------
+cache = make_cache(app.config['CACHE_BACKEND'], app.config['CACHE_REDIS_URL'],
+                   ttl=app.config['CACHE_TTL'], max_entries=app.config['CACHE_MAX_ENTRIES'])
+instrumentation = Instrumentation(app, slow_query_ms=app.config['SLOW_QUERY_MS'],
+                                  slow_request_ms=app.config['SLOW_REQUEST_MS'])
+if app.config['INSTRUMENTATION']:
+    instrumentation.install()  # before the other request hooks, so their queries are counted too
+
+def bump_version(*names, conn=None):
+    """Increment data version counters inside the caller's transaction (db.session unless `conn` is given)."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(DataVersion).values([{'name': n, 'version': 1} for n in names])
+    stmt = stmt.on_conflict_do_update(index_elements=['name'], set_={'version': DataVersion.version + 1})
+    (conn or db.session).execute(stmt)
+
+# changes whenever the code or templates are redeployed, so old ETags don't outlive the markup they describe
+BUILD_TAG = str(max(os.path.getmtime(os.path.join(root, f))
+                    for root, _, files in os.walk(os.path.join(BASE_DIR, 'templates')) for f in files)
+                + os.path.getmtime(__file__))
+
+def versioned(*names, extra=None):
+    """Strong ETag + If-None-Match for a GET view whose output depends only on the named data versions,
+    the URL and the logged-in user. A matching request gets a 304 without running the view.
+
+    `extra` is a callable for anything else the output depends on (e.g. today's date); its value joins the key.
+    """
+    def deco(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if '_flashes' in session:  # pending flash messages make the page one-off
+                return f(*args, **kwargs)
+            rows = dict(db.session.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(names)).all())
+            key = '|'.join([BUILD_TAG, request.full_path, str(session.get('user_id')), str(session.get('role'))]
+                           + [f'{n}={rows.get(n, 0)}' for n in names] + ([str(extra())] if extra else []))
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            for suffix in ('',) + tuple(SUFFIXES.values()):
+                if request.if_none_match.contains(etag + suffix):
+                    resp = Response(status=304)
+                    resp.set_etag(etag + suffix)
+                    break
+            else:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                resp.set_etag(etag)
+            # personalised pages: browsers may keep them but must revalidate every time
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            resp.vary.add('Cookie')
+            return resp
+        return wrapper
+    return deco
+
+@app.after_request
+def compress(resp):
+    if app.config['COMPRESS_RESPONSES']:
+        compress_response(resp, request.accept_encodings, app.config['COMPRESS_MIN_BYTES'], app.config['COMPRESS_LEVEL'])
+    return resp
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in ALLOWED_EXTENSIONS
 
+def mark_image_variants(key):
+    # called from the image pipeline once every variant of `path` is on disk
+    pid, path = key
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(Product.__table__.update()
+                         .where(Product.id == pid, Product.image_path == path)
+                         .values(image_variants=True))
+            bump_version('catalog', conn=conn)
+    cache.delete(f'product:{pid}')
+
+image_pipeline = ImagePipeline(workers=app.config['IMAGE_WORKERS'], on_done=mark_image_variants)
+
+# uploads are stored by content hash: uploads/ab/cd/abcd...<sha256>.ext (+ _<variant>.<fmt> files)
+CONTENT_ADDRESSED = re.compile(r'^uploads/([0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(?:_[a-z]+)?\.[a-z0-9]+)$')
+
+def save_upload(f):
+    """Store an uploaded image under its content hash, reusing an identical earlier upload.
+
+    Returns (static path, raw bytes for the image pipeline); the bytes are None when
+    resized variants already exist for this content.
+    """
+    data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    ext = f.filename.rsplit('.',1)[1].lower().replace('jpeg', 'jpg')
+    rel = f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+    dest = os.path.join(app.config['UPLOAD_FOLDER'], rel)
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as out:
+            out.write(data)
+        os.replace(tmp, dest)
+    elif os.path.exists(variant_path(dest, 'full', 'jpg')):
+        data = None
+    return f"uploads/{rel}", data
+
+def release_upload(path):
+    """Delete a content-addressed upload and its variants once no product references it."""
+    if not path or not CONTENT_ADDRESSED.match(path):
+        return  # legacy per-upload filenames are left alone
+    if Product.query.filter_by(image_path=path).count():
+        return
+    files = [path] + [variant_path(path, v, fmt) for v in VARIANTS for fmt in ('webp', 'jpg')]
+    for rel in files:
+        try:
+            os.remove(os.path.join(app.static_folder, rel))
+        except FileNotFoundError:
+            pass
+
+@app.template_global()
+def upload_url(path):
+    if not path:  # products may be listed without an image
+        return 'data:image/gif;base64,R0lGODlhAQABAAAAACH5BAEKAAEALAAAAAABAAEAAAICTAEAOw=='
+    m = CONTENT_ADDRESSED.match(path)
+    return url_for('media', key=m.group(1)) if m else url_for('static', filename=path)
+
+@app.template_global()
+def image_srcset(path, fmt):
+    return ', '.join(f"{upload_url(variant_path(path, v, fmt))} {w}w" for v, w in VARIANTS.items())
+
+app.add_template_global(variant_path)
+
 def login_required(role=None):
     def decorator(f):
         @wraps(f)
@@ -157,13 +481,318 @@ def login_required(role=None):
         return wrapper
     return decorator
 
-def log_action(actor_id, action, description=''):
+def encode_cursor(created_at, row_id):
+    # opaque keyset cursor for (created_at, id) ordered listings
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
     try:
-        a = AuditLog(actor_id=actor_id, action=action, description=description)
-        db.session.add(a)
-        db.session.commit()
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        ts, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(ts), int(row_id)
     except Exception:
-        db.session.rollback()
+        return None
+
+def page_rows(rows, cursor, limit):
+    # keyset_page() for rows already in memory, e.g. read from an archive file
+    after = decode_cursor(cursor) if cursor else None
+    rows = sorted((r for r in rows if not after or (r.created_at, r.id) < after),
+                  key=lambda r: (r.created_at, r.id), reverse=True)
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit-1].created_at, rows[limit-1].id)
+    return rows, None
+
+def keyset_page(query, created_col, id_col, cursor, limit):
+    """Newest-first page of `query` after `cursor`; returns (rows, next_cursor)."""
+    from sqlalchemy import tuple_
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        query = query.filter(tuple_(created_col, id_col) < after)
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+def fts_query(q):
+    # quote every word and prefix-match it, so user input can't break MATCH syntax
+    return ' '.join(f'"{w}"*' for w in re.findall(r'\w+', q))
+
+def search_products(query, q):
+    """Restrict `query` to products matching `q`, best matches first."""
+    if db.engine.dialect.name != 'sqlite':
+        return query.filter(Product.name.ilike(f'%{q}%') | Product.description.ilike(f'%{q}%'))
+    match = fts_query(q)
+    if not match:
+        return query.filter(False)
+    return (query.join(products_fts, products_fts.c.rowid == Product.id)
+                 .filter(products_fts.c.products_fts.op('MATCH')(match))
+                 .order_by(products_fts.c.rank, Product.id.desc()))
+
+def ranked_page(query, cursor, limit):
+    # relevance/rating orderings aren't unique, so page by position instead of keyset
+    offset = int(cursor) if cursor.isdigit() else 0
+    rows = query.offset(offset).limit(limit + 1).all()
+    next_cursor = str(offset + limit) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def filter_catalog(query, args):
+    """Apply the marketplace price/rating filters from request args (bad numbers are ignored)."""
+    try:
+        if args.get('min','').strip(): query = query.filter(Product.price >= float(args['min']))
+        if args.get('max','').strip(): query = query.filter(Product.price <= float(args['max']))
+        if args.get('rating','').strip(): query = query.filter(Product.rating_avg >= float(args['rating']))
+    except ValueError:
+        pass
+    return query
+
+def catalog_page(query, q, sort, cursor, limit):
+    """One page of products: by relevance when searching, by rating on request, newest first otherwise."""
+    if q:
+        return ranked_page(search_products(query, q), cursor, limit)
+    if sort=='rating':
+        return ranked_page(query.order_by(Product.rating_avg.desc(), Product.id.desc()), cursor, limit)
+    return keyset_page(query, Product.created_at, Product.id, cursor, limit)
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def order_lines(o):
+    """(product_id, product_name, quantity, amount) for every line of an order."""
+    if o.order_items:
+        return [(it.product_id, it.product_name or o.product_name, it.quantity, it.subtotal) for it in o.order_items]
+    return [(o.product_id, o.product_name, o.quantity, o.price_each * o.quantity)]
+
+def bump_daily_sales(o, product_id, product_name, order_count=0, quantity=0, revenue=0.0):
+    """Add deltas to the rollup row for one line of order `o`; runs inside the caller's transaction."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    day = (o.created_at or datetime.utcnow()).date()
+    stmt = insert(DailySales).values(day=day, vendor_id=o.vendor_id or 0, product_id=product_id or 0,
+                                     product_name=product_name, order_count=order_count,
+                                     quantity=quantity, revenue=revenue)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'vendor_id', 'product_id'],
+        set_={'order_count': DailySales.order_count + stmt.excluded.order_count,
+              'quantity': DailySales.quantity + stmt.excluded.quantity,
+              'revenue': DailySales.revenue + stmt.excluded.revenue})
+    db.session.execute(stmt)
+
+def record_order_sales(o):
+    # the order itself is counted once, on its first line
+    for n, (pid, name, qty, _) in enumerate(order_lines(o)):
+        bump_daily_sales(o, pid, name, order_count=1 if n == 0 else 0, quantity=qty)
+
+def record_delivery_change(o, sign):
+    for pid, name, _, amount in order_lines(o):
+        bump_daily_sales(o, pid, name, revenue=sign * amount)
+
+def rebuild_daily_sales():
+    """Recompute the whole rollup from orders and their items."""
+    from sqlalchemy import func, case, insert, select, union_all, exists, literal
+    items = (select(Order.id.label('order_id'), Order.created_at, Order.vendor_id, Order.status,
+                    OrderItem.id.label('line'), OrderItem.product_id,
+                    func.coalesce(OrderItem.product_name, Order.product_name).label('product_name'),
+                    OrderItem.quantity, OrderItem.subtotal.label('amount'))
+             .join(OrderItem, OrderItem.order_id == Order.id))
+    bare = (select(Order.id, Order.created_at, Order.vendor_id, Order.status, literal(0), Order.product_id,
+                   Order.product_name, Order.quantity, Order.price_each * Order.quantity)
+            .where(~exists().where(OrderItem.order_id == Order.id)))
+    lines = union_all(items, bare).subquery()
+    numbered = select(lines, func.row_number().over(partition_by=lines.c.order_id, order_by=lines.c.line).label('n')).subquery()
+    day = func.date(numbered.c.created_at)
+    vendor = func.coalesce(numbered.c.vendor_id, 0)
+    product = func.coalesce(numbered.c.product_id, 0)
+    src = (select(day, vendor, product, func.max(numbered.c.product_name),
+                  func.sum(case((numbered.c.n == 1, 1), else_=0)), func.sum(numbered.c.quantity),
+                  func.sum(case((numbered.c.status == 'Delivered', numbered.c.amount), else_=0)))
+           .where(numbered.c.created_at.isnot(None))
+           .group_by(day, vendor, product))
+    db.session.query(DailySales).delete()
+    db.session.execute(insert(DailySales).from_select(
+        ['day', 'vendor_id', 'product_id', 'product_name', 'order_count', 'quantity', 'revenue'], src))
+    db.session.commit()
+
+def write_audit_rows(rows):
+    # one executemany on its own connection, independent of the request's session
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(AuditLog.__table__.insert(), rows)
+
+audit_sink = AuditSink(write_audit_rows, batch_size=app.config['AUDIT_BATCH_SIZE'],
+                       flush_interval=app.config['AUDIT_FLUSH_INTERVAL'],
+                       sync=app.config['AUDIT_LOG_MODE'] == 'sync')
+
+def cached_product(pid):
+    """Product snapshot for read-only pages, shaped like a Product (p.vendor.fullname etc.)."""
+    def load():
+        p = db.session.get(Product, pid)
+        if p is None:
+            return None
+        vendor = {'fullname': p.vendor.fullname, 'username': p.vendor.username} if p.vendor else None
+        return {'id': p.id, 'name': p.name, 'price': p.price, 'quantity': p.quantity,
+                'description': p.description, 'image_path': p.image_path,
+                'image_variants': bool(p.image_variants), 'vendor_id': p.vendor_id, 'vendor': vendor}
+    data = cache.get_or_set(f'product:{pid}', load)
+    if data is None:
+        abort(404)
+    return SimpleNamespace(**dict(data, vendor=SimpleNamespace(**data['vendor']) if data['vendor'] else None))
+
+def rating_stats(pid):
+    """{'count', 'average', 'histogram'} for a product; histogram[i] counts (i+1)-star reviews."""
+    def load():
+        from sqlalchemy import func
+        hist = [0] * 5
+        for rating, n in (db.session.query(ProductReview.rating, func.count(ProductReview.id))
+                          .filter(ProductReview.product_id == pid).group_by(ProductReview.rating)):
+            if rating in (1, 2, 3, 4, 5):
+                hist[rating - 1] = n
+        count = sum(hist)
+        average = round(sum((i + 1) * n for i, n in enumerate(hist)) / count, 2) if count else None
+        return {'count': count, 'average': average, 'histogram': hist}
+    return cache.get_or_set(f'rating:{pid}', load)
+
+def review_page(pid, cursor, limit):
+    q = ProductReview.query.options(db.joinedload(ProductReview.user)).filter(ProductReview.product_id == pid)
+    return keyset_page(q, ProductReview.created_at, ProductReview.id, cursor, limit)
+
+def with_retries(fn, attempts=5):
+    """Run a unit of work that commits, retrying with backoff when SQLite reports lock contention.
+
+    Cached snapshots of products whose stock the work changed are dropped once it has committed.
+    """
+    from sqlalchemy.exc import OperationalError
+    for attempt in range(attempts):
+        stale = db.session.info['stock_changed'] = set()
+        try:
+            result = fn()
+        except OperationalError as e:
+            db.session.rollback()
+            contended = 'locked' in str(e.orig) or 'busy' in str(e.orig)
+            if not contended or attempt == attempts - 1:
+                raise
+            time.sleep(0.02 * 2 ** attempt + random.random() * 0.02)
+        else:
+            if stale:
+                cache.delete(*(f'product:{pid}' for pid in stale))
+            return result
+
+def reserve_stock(pid, qty):
+    # single conditional UPDATE: two buyers can never both take the last units
+    res = db.session.execute(Product.__table__.update()
+                             .where(Product.id == pid, Product.quantity >= qty)
+                             .values(quantity=Product.quantity - qty))
+    if res.rowcount == 1:
+        bump_version('catalog')
+        db.session.info.setdefault('stock_changed', set()).add(pid)
+    return res.rowcount == 1
+
+def release_stock(pid, qty):
+    if pid:
+        db.session.execute(Product.__table__.update().where(Product.id == pid)
+                           .values(quantity=Product.quantity + qty))
+        bump_version('catalog')
+        db.session.info.setdefault('stock_changed', set()).add(pid)
+
+def release_expired_reservations():
+    """Cancel unpaid orders whose reservation has lapsed and put their stock back; returns how many."""
+    def sweep():
+        expired = queries.load(Order.query, 'order_lines').filter(Order.reserved_until < datetime.utcnow(), Order.status == 'Pending',
+                                     ~Order.payments.any(Payment.payment_status == 'Pending')).all()
+        for o in expired:
+            for pid, _, qty, _ in order_lines(o):
+                release_stock(pid, qty)
+            o.status = 'Cancelled'; o.reserved_until = None
+        if expired:
+            bump_version('orders')
+        db.session.commit()
+        return len(expired)
+    return with_retries(sweep)
+
+_last_sweep = [0.0]
+
+@app.before_request
+def sweep_reservations():
+    # cheap throttle: at most one sweep per minute per process
+    if time.monotonic() - _last_sweep[0] < 60:
+        return
+    _last_sweep[0] = time.monotonic()
+    if release_expired_reservations():
+        app.logger.info('released expired stock reservations')
+
+# the one list offered by the payment and checkout forms, the payment history filter and bench/seed_data.py
+PAYMENT_METHODS = ('GCash', 'Bank Transfer', 'Credit Card', 'Cash on Delivery')
+
+COD_METHODS = ('Cash on Delivery', 'COD')  # 'COD' in older rows and database/seed.sql
+
+@app.template_global()
+def is_cod(method):
+    # cash on delivery is collected by the vendor, never sent to the gateway
+    return method in COD_METHODS
+
+def log_action(actor_id, action, description=''):
+    audit_sink.submit({'actor_id': actor_id, 'action': action, 'description': description,
+                       'created_at': datetime.utcnow()})
+
+payment_gateway = make_gateway(app.config['PAYMENT_GATEWAY'])
+
+def apply_payment_result(payment_id, status, reference=None, message=None):
+    """Record a gateway outcome for a Pending payment; returns the new status, or 'duplicate' if already settled.
+    Shared by the settlement workers and the webhook, so each payment is settled exactly once."""
+    if status == 'processing':  # gateway will confirm through the webhook
+        db.session.execute(Payment.__table__.update().where(Payment.id == payment_id)
+                           .values(gateway_ref=reference))
+        db.session.commit()
+        return 'Pending'
+    new = 'Completed' if status == 'succeeded' else 'Failed'
+    res = db.session.execute(Payment.__table__.update()
+                             .where(Payment.id == payment_id, Payment.payment_status == 'Pending')
+                             .values(payment_status=new, gateway_ref=db.func.coalesce(reference, Payment.gateway_ref),
+                                     last_error=(message or None) if new == 'Failed' else None,
+                                     settled_at=datetime.utcnow()))
+    if res.rowcount != 1:
+        db.session.rollback(); return 'duplicate'
+    p = db.session.get(Payment, payment_id)
+    if new == 'Completed':
+        # a failed payment leaves the order Pending with its reservation, so the buyer can try again
+        db.session.execute(Order.__table__.update().where(Order.id == p.order_id, Order.status == 'Pending')
+                           .values(status='Paid', reserved_until=None))
+    bump_version('orders')
+    db.session.commit()
+    log_action(None, 'payment_settled', f'Payment {payment_id} {new} order={p.order_id}')
+    return new
+
+def settle_payment(payment_id):
+    """Charge one Pending payment, retrying transient gateway errors with backoff. Safe to run twice."""
+    with app.app_context():
+        p = db.session.get(Payment, payment_id)
+        if p is None or p.payment_status != 'Pending' or is_cod(p.payment_method):
+            return
+        while True:
+            try:
+                result = payment_gateway.charge(f'payment-{p.id}', p.amount_paid, p.payment_method, p.idempotency_key)
+                break
+            except GatewayError as e:
+                p.attempts = (p.attempts or 0) + 1; p.last_error = str(e)[:300]
+                db.session.commit()
+                if p.attempts >= app.config['PAYMENT_MAX_ATTEMPTS']:
+                    apply_payment_result(p.id, 'failed', message=f'gave up after {p.attempts} attempts: {e}')
+                    return
+                time.sleep(backoff(p.attempts))
+        apply_payment_result(p.id, result.status, result.reference, result.message)
+
+payment_pipeline = PaymentPipeline(settle_payment, workers=app.config['PAYMENT_WORKERS'])
+
+if app.config['QUERY_BUDGET'] is not None:
+    QueryBudget(app, default=app.config['QUERY_BUDGET']).install()  # after the reservation sweep: not a view's cost
 
 # ---------- ROUTES ----------
 @app.route('/')
@@ -233,11 +862,10 @@ def create_admin():
 @app.route('/vendor/dashboard')
 @login_required(role='vendor')
 def vendor_dashboard():
+    # no queries.plan: the template only reads product/order columns, never a relationship
     user = User.query.get(session['user_id'])
     products = Product.query.filter_by(vendor_id=user.id).all()
-    # orders where vendor_name matches vendor fullname or username
-    vname = user.fullname or user.username
-    orders = Order.query.filter_by(vendor_name=vname).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter_by(vendor_id=user.id).order_by(Order.created_at.desc()).all()
     return render_template('vendor_dashboard.html', user=user, products=products, orders=orders)
 
 @app.route('/add_product', methods=['GET','POST'])
@@ -249,14 +877,14 @@ def add_product():
         qty = int(request.form['quantity'])
         desc = request.form.get('description','').strip()
         f = request.files.get('image')
-        imgpath = None
+        imgpath = data = None
         if f and f.filename:
             if not allowed_file(f.filename): flash('Invalid image','danger'); return redirect(url_for('add_product'))
-            fn = secure_filename(f"{session['username']}_{int(datetime.utcnow().timestamp())}_{f.filename}")
-            f.save(os.path.join(app.config['UPLOAD_FOLDER'], fn))
-            imgpath = f"uploads/{fn}"
-        p = Product(name=name, price=price, quantity=qty, description=desc, image_path=imgpath, vendor_id=session['user_id'])
-        db.session.add(p); db.session.commit()
+            imgpath, data = save_upload(f)
+        p = Product(name=name, price=price, quantity=qty, description=desc, image_path=imgpath, vendor_id=session['user_id'],
+                    image_variants=bool(imgpath) and data is None)
+        db.session.add(p); bump_version('catalog'); db.session.commit()
+        if data: image_pipeline.submit(data, os.path.join(app.static_folder, imgpath), key=(p.id, imgpath))
         log_action(session['user_id'], 'add_product', f'Added product {name}')
         flash('Product added','success'); return redirect(url_for('add_product'))
     my_products = Product.query.filter_by(vendor_id=session['user_id']).all()
@@ -272,11 +900,15 @@ def edit_product(pid):
         p.name = request.form['name'].strip()
         p.price = float(request.form['price']); p.quantity = int(request.form['quantity']); p.description = request.form.get('description','').strip()
         f = request.files.get('image')
+        data = None; old_image = p.image_path
         if f and f.filename and allowed_file(f.filename):
-            fn = secure_filename(f"{session['username']}_{int(datetime.utcnow().timestamp())}_{f.filename}")
-            f.save(os.path.join(app.config['UPLOAD_FOLDER'], fn))
-            p.image_path = f"uploads/{fn}"
-        db.session.commit(); log_action(session['user_id'], 'edit_product', f'Edited product {p.id}')
+            p.image_path, data = save_upload(f)
+            p.image_variants = data is None
+        bump_version('catalog'); db.session.commit()
+        cache.delete(f'product:{p.id}')
+        if data: image_pipeline.submit(data, os.path.join(app.static_folder, p.image_path), key=(p.id, p.image_path))
+        if old_image != p.image_path: release_upload(old_image)
+        log_action(session['user_id'], 'edit_product', f'Edited product {p.id}')
         flash('Updated','success'); return redirect(url_for('add_product'))
     return render_template('edit_product.html', product=p)
 
@@ -286,52 +918,164 @@ def delete_product(pid):
     p = Product.query.get_or_404(pid)
     if p.vendor_id!=session['user_id'] and session.get('role')!='admin':
         flash('Access denied','danger'); return redirect(url_for('marketplace'))
-    db.session.delete(p); db.session.commit()
+    image = p.image_path
+    db.session.delete(p); bump_version('catalog'); db.session.commit()
+    cache.delete(f'product:{pid}', f'rating:{pid}')
+    release_upload(image)
     log_action(session['user_id'], 'delete_product', f'Deleted product {pid}')
     flash('Product removed','info'); return redirect(request.referrer or url_for('vendor_dashboard'))
 
+def import_products_rows(rows, vendor_id, dry_run=False):
+    """Validate (row_number, raw) pairs against the vendor's catalogue, then apply every valid row in one
+    transaction of batched executemany statements. Rows with an id, or whose name matches one of the vendor's
+    products, update it; other rows create products. Returns a report dict."""
+    from sqlalchemy import bindparam, insert, update
+    existing = {}; by_name = {}
+    for pid, name in db.session.query(Product.id, Product.name).filter(Product.vendor_id == vendor_id):
+        existing[pid] = name
+        by_name.setdefault(name.lower(), []).append(pid)
+    creates, updates, errors, seen, total = [], [], [], set(), 0
+    for n, raw in rows:
+        if total == app.config['IMPORT_MAX_ROWS']:
+            errors.append({'row': n, 'errors': [f"import stopped: more than {total} rows"]})
+            break
+        total += 1
+        values, problems = inventory_import.parse_row(raw)
+        pid = values.pop('id', None)
+        if pid is None and 'name' in values:
+            matches = by_name.get(values['name'].lower(), [])
+            if len(matches) > 1:
+                problems.append('several of your products have this name; give the id')
+            pid = matches[0] if len(matches) == 1 else None
+        if pid is not None and pid not in existing:
+            problems.append(f'product {pid} not found in your catalogue')
+        key = pid if pid is not None else values.get('name', '').lower()
+        if key in seen:
+            problems.append('same product appears earlier in this import')
+        if pid is None and not problems:
+            problems += [f'{f} is required for a new product' for f in ('name', 'price', 'quantity') if f not in values]
+        if problems:
+            errors.append({'row': n, 'errors': problems}); continue
+        seen.add(key)
+        if pid is None:
+            creates.append(dict({'description': ''}, **values, vendor_id=vendor_id))
+        elif values.keys() - {'name'} or values.get('name', existing[pid]) != existing[pid]:
+            updates.append(dict({f'b_{k}': v for k, v in values.items()}, b_id=pid))
+    report = {'rows': total, 'created': len(creates), 'updated': len(updates),
+              'errors': errors, 'dry_run': dry_run}
+    if dry_run or not (creates or updates):
+        return report
+    batch = app.config['IMPORT_BATCH_SIZE']
+    def apply():
+        for i in range(0, len(creates), batch):
+            db.session.execute(insert(Product), creates[i:i + batch])
+        # one executemany per distinct column set; add_quantity is relative so concurrent orders aren't lost
+        groups = {}
+        for u in updates:
+            groups.setdefault(tuple(sorted(u.keys() - {'b_id'})), []).append(u)
+        for cols, group in groups.items():
+            values = {c[2:]: bindparam(c) for c in cols}
+            if 'add_quantity' in values:
+                values['quantity'] = Product.quantity + values.pop('add_quantity')
+            stmt = update(Product.__table__).where(Product.id == bindparam('b_id')).values(values)
+            for i in range(0, len(group), batch):
+                db.session.execute(stmt, group[i:i + batch])
+        bump_version('catalog')
+        db.session.commit()
+    with_retries(apply)
+    cache.delete(*(f"product:{u['b_id']}" for u in updates))
+    log_action(vendor_id, 'import_products', f'Imported products: {len(creates)} created, {len(updates)} updated, '
+                                              f'{len(errors)} rows rejected')
+    return report
+
+@app.route('/products/import', methods=['GET','POST'])
+@query_budget(10 + app.config['IMPORT_MAX_ROWS'] // app.config['IMPORT_BATCH_SIZE'])  # one executemany per batch
+@login_required(role='vendor')
+def import_products():
+    """Bulk create/update products from an uploaded CSV file or a JSON body ({"rows": [...]} or a list)."""
+    wants_json = request.is_json or request.accept_mimetypes.best == 'application/json'
+    if request.method=='GET':
+        return render_template('import_products.html', report=None, fields=inventory_import.FIELDS)
+    dry_run = request.values.get('dry_run') in ('1', 'true', 'on')
+    try:
+        if request.is_json:
+            rows = inventory_import.read_json(request.get_json())
+        else:
+            f = request.files.get('file')
+            if not f or not f.filename:
+                raise ValueError('choose a CSV file to import')
+            rows = inventory_import.read_csv(f.stream)
+        report = import_products_rows(rows, session['user_id'], dry_run)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'Could not read the import: {e}','danger'); return redirect(url_for('import_products'))
+    if wants_json:
+        return jsonify(report)
+    return render_template('import_products.html', report=report, fields=inventory_import.FIELDS)
+
+@app.route('/media/<path:key>')
+def media(key):
+    # content-addressed uploads never change at a given URL, so browsers may cache them forever
+    if not CONTENT_ADDRESSED.match(f"uploads/{key}"):
+        abort(404)
+    etag = os.path.splitext(os.path.basename(key))[0]
+    resp = send_from_directory(app.config['UPLOAD_FOLDER'], key, etag=etag, max_age=31536000)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
 # ---------- MARKETPLACE ----------
 @app.route('/marketplace')
+@versioned('catalog')
 def marketplace():
     q = request.args.get('q','').strip()
     minp = request.args.get('min','').strip()
     maxp = request.args.get('max','').strip()
-    products_q = Product.query
-    if q: products_q = products_q.filter(Product.name.ilike(f'%{q}%'))
-    try:
-        if minp: products_q = products_q.filter(Product.price >= float(minp))
-        if maxp: products_q = products_q.filter(Product.price <= float(maxp))
-    except:
-        pass
-    products = products_q.order_by(Product.created_at.desc()).all()
-    return render_template('marketplace.html', products=products, q=q, minp=minp, maxp=maxp)
+    min_rating = request.args.get('rating','').strip()
+    sort = request.args.get('sort','').strip()
+    cursor = request.args.get('cursor','').strip()
+    products_q = filter_catalog(queries.load(Product.query, 'product_vendor'), request.args)
+    products, next_cursor = catalog_page(products_q, q, sort, cursor, app.config['CATALOG_PAGE_SIZE'])
+    return render_template('marketplace.html', products=products, q=q, minp=minp, maxp=maxp,
+                           min_rating=min_rating, sort=sort, cursor=cursor, next_cursor=next_cursor)
 
 @app.route('/product/<int:pid>')
+@versioned('catalog')
 def product_detail(pid):
-    p = Product.query.get_or_404(pid)
-    reviews = ProductReview.query.filter_by(product_id=pid).order_by(ProductReview.created_at.desc()).all()
-    return render_template('product_detail.html', p=p, reviews=reviews)
+    p = cached_product(pid)
+    reviews, more = review_page(pid, '', 5)
+    return render_template('product_detail.html', p=p, reviews=reviews, more_reviews=bool(more), stats=rating_stats(pid))
 
 # ---------- ORDER + PAYMENT ----------
 @app.route('/order/<int:pid>', methods=['GET','POST'])
 @login_required(role='consumer')
 def order(pid):
-    p = Product.query.get_or_404(pid)
+    p = queries.load(Product.query, 'product_vendor').get_or_404(pid)
     if request.method=='POST':
         qty = int(request.form['quantity'])
-        if qty<=0 or qty>p.quantity:
+        if qty<=0:
             flash('Invalid qty','danger'); return redirect(url_for('order', pid=pid))
-        vendor = p.vendor.fullname or p.vendor.username if p.vendor else ''
-        # create snapshot Order
-        o = Order(product_id=p.id, product_name=p.name, vendor_name=vendor,
-                  buyer_id=session['user_id'], quantity=qty, price_each=p.price, status='Pending')
-        db.session.add(o)
-        db.session.flush()  # get o.id
-        # create OrderItem for record (keeps details consistent)
-        oi = OrderItem(order_id=o.id, product_id=p.id, quantity=qty, price_each=p.price, subtotal=round(qty * p.price,2))
-        p.quantity -= qty
-        db.session.add(oi)
-        db.session.commit()
+        def place():
+            if not reserve_stock(pid, qty):
+                db.session.rollback(); return None
+            vendor = p.vendor.fullname or p.vendor.username if p.vendor else ''
+            # create snapshot Order, holding the stock until it is paid or the reservation lapses
+            o = Order(product_id=p.id, product_name=p.name, vendor_name=vendor, vendor_id=p.vendor_id,
+                      buyer_id=session['user_id'], quantity=qty, price_each=p.price, status='Pending',
+                      reserved_until=datetime.utcnow() + timedelta(minutes=app.config['RESERVATION_MINUTES']))
+            db.session.add(o)
+            db.session.flush()  # get o.id
+            # create OrderItem for record (keeps details consistent)
+            oi = OrderItem(order_id=o.id, product_id=p.id, product_name=p.name, quantity=qty, price_each=p.price, subtotal=round(qty * p.price,2))
+            db.session.add(oi)
+            record_order_sales(o)
+            bump_version('orders')
+            db.session.commit()
+            return o
+        o = with_retries(place)
+        if o is None:
+            flash('Not enough stock left for that quantity','danger'); return redirect(url_for('order', pid=pid))
         log_action(session['user_id'], 'create_order', f'Order {o.id} for product {p.id}')
         flash('Order placed. Please proceed to payment.','success')
         return redirect(url_for('pay', oid=o.id))
@@ -340,7 +1084,7 @@ def order(pid):
 @app.route('/pay/<int:oid>', methods=['GET','POST'])
 @login_required(role='consumer')
 def pay(oid):
-    o = Order.query.get_or_404(oid)
+    o = queries.load(Order.query, 'pay').get_or_404(oid)
     if o.buyer_id != session.get('user_id'):
         flash('Access denied','danger'); return redirect(url_for('orders'))
     # calc total
@@ -349,45 +1093,44 @@ def pay(oid):
     else:
         total = o.price_each * o.quantity
     if request.method=='POST':
-        method = request.form.get('method','COD')
-        status = 'Completed' if method != 'Cash on Delivery' and method != 'COD' else 'Pending'
-        pay = Payment(order_id=o.id, amount_paid=total, payment_method=method, payment_status=status)
+        method = request.form.get('method','')
+        if method not in PAYMENT_METHODS:
+            flash('Choose a payment method','danger'); return redirect(url_for('pay', oid=o.id))
+        key = request.form.get('idempotency_key','').strip()[:64] or uuid.uuid4().hex
+        if o.status != 'Pending' or any(p.payment_status != 'Failed' for p in o.payments):
+            return redirect(url_for('payment_success', oid=o.id))  # resubmitted form, payment in flight or paid
+        pay = Payment(order_id=o.id, amount_paid=total, payment_method=method, payment_status='Pending',
+                      idempotency_key=key)
         db.session.add(pay)
-        if status == 'Completed':
-            o.status = 'Paid'
-        db.session.commit()
+        if is_cod(method):
+            o.reserved_until = None  # reservation becomes a sale; cash is collected on delivery
+        bump_version('orders')
+        try:
+            db.session.commit()
+        except IntegrityError:  # same key submitted twice concurrently
+            db.session.rollback(); return redirect(url_for('payment_success', oid=o.id))
+        if not is_cod(method):
+            payment_pipeline.submit(pay.id)
         log_action(session.get('user_id'), 'payment', f'Payment {pay.id} method={method} order={o.id}')
-        flash('Payment recorded','success')
+        flash('Payment submitted','success')
         return redirect(url_for('payment_success', oid=o.id))
-    return render_template('payment.html', order=o, total=total)
-
-@app.route('/process_payment/<int:order_id>', methods=['POST'])
-@login_required
-def process_payment(order_id):
-    payment_method = request.form.get('payment_method')
-
-    conn = get_db_connection()
-
-    # Verify order exists and belongs to the user
-    order = conn.execute(
-        "SELECT * FROM orders WHERE id = ? AND customer_id = ?",
-        (order_id, session['user_id'])
-    ).fetchone()
-
-    if not order:
-        conn.close()
-        flash("Order not found.", "danger")
-        return redirect(url_for('orders'))
-
-    # Update payment record
-    conn.execute(
-        "UPDATE orders SET payment_method = ?, payment_status = 'Paid' WHERE id = ?",
-        (payment_method, order_id)
-    )
-    conn.commit()
-    conn.close()
-
-    return redirect(url_for('payment_success'))
+    return render_template('payment.html', order=o, total=total, methods=PAYMENT_METHODS, idempotency_key=uuid.uuid4().hex)
+
+@app.route('/payments/webhook', methods=['POST'])
+def payment_webhook():
+    # gateway callback: {"idempotency_key", "status": succeeded|declined, "reference", "message"}, HMAC-SHA256 signed
+    secret = app.config['PAYMENT_WEBHOOK_SECRET']
+    if not secret:
+        abort(404)
+    expected = hmac.new(secret.encode(), request.get_data(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, request.headers.get('X-Signature', '')):
+        abort(401)
+    event = request.get_json(silent=True) or {}
+    p = Payment.query.filter_by(idempotency_key=str(event.get('idempotency_key', ''))).first()
+    if p is None or event.get('status') not in ('succeeded', 'declined', 'processing'):
+        return jsonify({'error': 'unknown payment or status'}), 400
+    result = apply_payment_result(p.id, event['status'], event.get('reference'), event.get('message'))
+    return jsonify({'payment_id': p.id, 'status': result})
 
 
 @app.route('/payment_success/<int:oid>')
@@ -395,81 +1138,230 @@ def process_payment(order_id):
 def payment_success(oid):
     o = Order.query.get_or_404(oid)
     latest_payment = Payment.query.filter_by(order_id=o.id).order_by(Payment.payment_date.desc()).first()
-    return render_template('payment_success.html', order=o, payment=latest_payment)
+    return render_template('payments/payment_success.html', order=o, payment=latest_payment, oid=o.id,
+                           amount=latest_payment.amount_paid if latest_payment else 0)
 
 @app.route('/order_details/<int:oid>')
 @login_required()
 def order_details(oid):
     o = Order.query.get_or_404(oid)
-    # permission: buyer, vendor (match vendor_name), or admin
+    # permission: buyer, vendor of the order, or admin
     if session.get('role') == 'consumer' and o.buyer_id != session.get('user_id'):
         flash('Access denied','danger'); return redirect(url_for('orders'))
-    if session.get('role') == 'vendor':
-        user = User.query.get(session['user_id'])
-        if o.vendor_name != (user.fullname or user.username):
-            flash('Access denied','danger'); return redirect(url_for('orders'))
+    if session.get('role') == 'vendor' and o.vendor_id != session.get('user_id'):
+        flash('Access denied','danger'); return redirect(url_for('orders'))
     return render_template('order_details.html', order=o)
 
 @app.route('/orders')
 @login_required()
 def orders():
     role = session.get('role')
+    orders_q = queries.load(Order.query, 'orders').order_by(Order.created_at.desc())
     if role=='consumer':
-        orders_q = Order.query.filter_by(buyer_id=session['user_id']).order_by(Order.created_at.desc())
+        orders_q = orders_q.filter_by(buyer_id=session['user_id'])
     elif role=='vendor':
-        user = User.query.get(session['user_id'])
-        vname = user.fullname or user.username
-        orders_q = Order.query.filter_by(vendor_name=vname).order_by(Order.created_at.desc())
-    elif role=='admin':
-        orders_q = Order.query.order_by(Order.created_at.desc())
-    else:
-        orders_q = Order.query.filter(False)
+        orders_q = orders_q.filter_by(vendor_id=session['user_id'])
+    elif role!='admin':
+        orders_q = orders_q.filter(False)
     orders = orders_q.all()
     return render_template('orders.html', orders=orders)
 
 @app.route('/update_order/<int:oid>', methods=['POST'])
 @login_required()
 def update_order(oid):
-    o = Order.query.get_or_404(oid)
+    o = queries.load(Order.query, 'order_lines').get_or_404(oid)
     new = request.form.get('status')
     # only admin or vendor-of-order can update
-    if session.get('role')!='admin':
-        user = User.query.get(session['user_id'])
-        if o.vendor_name != (user.fullname or user.username):
-            flash('Access denied','danger'); return redirect(url_for('orders'))
+    if session.get('role')!='admin' and o.vendor_id != session.get('user_id'):
+        flash('Access denied','danger'); return redirect(url_for('orders'))
     if new in ('Pending','Processing','Shipped','Delivered','Cancelled','Paid'):
-        o.status = new; db.session.commit(); log_action(session.get('user_id'), 'update_order', f'Order {oid} set {new}')
+        def apply():
+            if (new=='Cancelled') != (o.status=='Cancelled'):
+                # cancelling returns the stock; reopening a cancelled order must take it again
+                for pid, _, qty, _ in order_lines(o):
+                    if new=='Cancelled':
+                        release_stock(pid, qty)
+                    elif pid and not reserve_stock(pid, qty):
+                        db.session.rollback(); return False
+                o.reserved_until = None
+            if (new=='Delivered') != (o.status=='Delivered'):
+                record_delivery_change(o, 1 if new=='Delivered' else -1)
+            o.status = new; bump_version('orders'); db.session.commit()
+            return True
+        if not with_retries(apply):
+            flash('Not enough stock to reopen this order','danger'); return redirect(request.referrer or url_for('orders'))
+        log_action(session.get('user_id'), 'update_order', f'Order {oid} set {new}')
         flash('Order updated','success')
     return redirect(request.referrer or url_for('orders'))
 
+# ---------- CART + CHECKOUT ----------
+def buyer_cart(create=False):
+    c = queries.load(Cart.query, 'cart').filter_by(buyer_id=session['user_id']).first()
+    if c is None and create:
+        c = Cart(buyer_id=session['user_id']); db.session.add(c)
+    return c
+
+@app.route('/cart')
+@login_required(role='consumer')
+def cart():
+    c = buyer_cart()
+    items = c.items if c else []
+    total = round(sum(it.product.price * it.quantity for it in items if it.product), 2)
+    return render_template('cart.html', items=items, total=total, methods=PAYMENT_METHODS, idempotency_key=uuid.uuid4().hex)
+
+@app.route('/cart/add/<int:pid>', methods=['POST'])
+@login_required(role='consumer')
+def cart_add(pid):
+    p = queries.load(Product.query, 'product_vendor').get_or_404(pid)
+    qty = request.form.get('quantity', 1, type=int)
+    if qty<=0:
+        flash('Invalid qty','danger'); return redirect(url_for('product_detail', pid=pid))
+    c = buyer_cart(create=True)
+    # one order per checkout means one vendor per cart (orders are scoped by vendor_id)
+    if any(it.product and it.product.vendor_id != p.vendor_id for it in c.items):
+        flash('Your cart has items from another vendor. Check out or empty it first.','warning')
+        return redirect(url_for('cart'))
+    item = next((it for it in c.items if it.product_id == pid), None)
+    if item is None:
+        item = CartItem(product_id=pid, quantity=0, price_each=p.price, subtotal=0); c.items.append(item)
+    item.quantity += qty; item.price_each = p.price; item.subtotal = round(p.price * item.quantity, 2)
+    db.session.commit()
+    flash(f'Added {p.name} to cart','success'); return redirect(url_for('cart'))
+
+@app.route('/cart/update/<int:item_id>', methods=['POST'])
+@login_required(role='consumer')
+def cart_update(item_id):
+    item = CartItem.query.get_or_404(item_id)
+    if item.cart.buyer_id != session['user_id']:
+        flash('Access denied','danger'); return redirect(url_for('cart'))
+    qty = request.form.get('quantity', 0, type=int)
+    if qty<=0:
+        db.session.delete(item)
+    else:
+        item.quantity = qty; item.subtotal = round(item.price_each * qty, 2)
+    db.session.commit()
+    return redirect(url_for('cart'))
+
+@app.route('/cart/checkout', methods=['POST'])
+@query_budget(40)  # a stock UPDATE per cart line, plus the settlement when PAYMENT_WORKERS=0
+@login_required(role='consumer')
+def cart_checkout():
+    method = request.form.get('method','')
+    if method not in PAYMENT_METHODS:
+        flash('Choose a payment method','danger'); return redirect(url_for('cart'))
+    key = request.form.get('idempotency_key','').strip()[:64] or uuid.uuid4().hex
+    done = Payment.query.filter_by(idempotency_key=key).first()
+    if done:  # resubmitted checkout form
+        return redirect(url_for('payment_success', oid=done.order_id))
+    def checkout():
+        c = buyer_cart()
+        items = [it for it in (c.items if c else []) if it.product]
+        if not items:
+            return None, 'Your cart is empty'
+        # take stock for every line first; any shortfall aborts the whole checkout
+        for it in items:
+            if not reserve_stock(it.product_id, it.quantity):
+                name = it.product.name
+                db.session.rollback(); return None, f'Not enough stock left for {name}'
+        first = items[0].product
+        vendor = first.vendor.fullname or first.vendor.username if first.vendor else ''
+        units = sum(it.quantity for it in items)
+        total = round(sum(it.product.price * it.quantity for it in items), 2)
+        o = Order(product_id=first.id if len(items) == 1 else None,
+                  product_name=', '.join(it.product.name for it in items)[:200], vendor_name=vendor,
+                  vendor_id=first.vendor_id, buyer_id=session['user_id'], quantity=units,
+                  price_each=total / units, status='Pending',  # price_each is the average for multi-item orders
+                  reserved_until=None if is_cod(method) else
+                  datetime.utcnow() + timedelta(minutes=app.config['RESERVATION_MINUTES']))
+        o.order_items = [OrderItem(product_id=it.product_id, product_name=it.product.name, quantity=it.quantity,
+                                   price_each=it.product.price, subtotal=round(it.product.price * it.quantity, 2))
+                         for it in items]
+        db.session.add(o)
+        db.session.flush()  # get o.id
+        pay = Payment(order_id=o.id, amount_paid=total, payment_method=method, payment_status='Pending', idempotency_key=key)
+        db.session.add(pay)
+        record_order_sales(o)
+        bump_version('orders')
+        db.session.delete(c)
+        db.session.flush()  # get pay.id; read ids now so nothing is reloaded after the commit
+        placed = SimpleNamespace(oid=o.id, payment_id=pay.id, lines=len(items))
+        db.session.commit()
+        return placed, None
+    try:
+        placed, error = with_retries(checkout)
+    except IntegrityError:  # same key submitted twice concurrently; the other request placed the order
+        db.session.rollback()
+        done = Payment.query.filter_by(idempotency_key=key).first()
+        return redirect(url_for('payment_success', oid=done.order_id) if done else url_for('cart'))
+    if error:
+        flash(error,'danger'); return redirect(url_for('cart'))
+    if not is_cod(method):
+        payment_pipeline.submit(placed.payment_id)
+    log_action(session['user_id'], 'checkout', f'Order {placed.oid} with {placed.lines} items method={method}')
+    flash('Order placed and payment submitted','success')
+    return redirect(url_for('payment_success', oid=placed.oid))
+
 # ---------- PAYMENTS (views for roles) ----------
+PAYMENT_STATUSES = ('Pending', 'Completed', 'Failed')
+
+def payment_filters():
+    return {k: request.args.get(k,'').strip() for k in ('start', 'end', 'status', 'method')}
+
+def filter_payments(q, filters, buyer_id=None, vendor_id=None):
+    # callers must have joined Order when scoping by buyer or vendor
+    start, end = parse_day(filters['start']), parse_day(filters['end'])
+    if buyer_id: q = q.filter(Order.buyer_id == buyer_id)
+    if vendor_id: q = q.filter(Order.vendor_id == vendor_id)
+    if start: q = q.filter(Payment.payment_date >= start)
+    if end: q = q.filter(Payment.payment_date < end + timedelta(days=1))
+    if filters['status']: q = q.filter(Payment.payment_status == filters['status'])
+    if filters['method']:
+        q = q.filter(Payment.payment_method.in_(COD_METHODS) if is_cod(filters['method'])
+                     else Payment.payment_method == filters['method'])
+    return q
+
+def payment_history(filters, cursor, buyer_id=None, vendor_id=None):
+    """One page of payments with their order and buyer, newest first; returns (rows, next_cursor)."""
+    q = (db.session.query(Payment.id, Payment.order_id, Payment.amount_paid, Payment.payment_method,
+                          Payment.payment_status, Payment.payment_date.label('created_at'), Order.product_name,
+                          Order.vendor_name, Order.quantity, User.username.label('buyer_name'))
+         .join(Order, Order.id == Payment.order_id)
+         .outerjoin(User, User.id == Order.buyer_id))
+    q = filter_payments(q, filters, buyer_id, vendor_id)
+    return keyset_page(q, Payment.payment_date, Payment.id, cursor, app.config['PAYMENT_PAGE_SIZE'])
+
+def payment_totals(filters):
+    """[(status, count, amount)] for every payment matching `filters`, aggregated in SQL."""
+    from sqlalchemy import func
+    q = db.session.query(Payment.payment_status, func.count(Payment.id), func.coalesce(func.sum(Payment.amount_paid), 0))
+    return filter_payments(q, filters).group_by(Payment.payment_status).order_by(Payment.payment_status).all()
+
+def render_payments(template, **scope):
+    filters = payment_filters(); cursor = request.args.get('cursor','').strip()
+    payments, next_cursor = payment_history(filters, cursor, **scope)
+    return render_template(template, payments=payments, filters=filters, cursor=cursor, next_cursor=next_cursor,
+                           statuses=PAYMENT_STATUSES, methods=PAYMENT_METHODS,
+                           totals=payment_totals(filters) if session.get('role')=='admin' else None)
+
 @app.route('/my_payments')
 @login_required(role='consumer')
 def my_payments():
-    uid = session.get('user_id')
-    payments = Payment.query.join(Order, Payment.order_id == Order.id).filter(Order.buyer_id == uid).order_by(Payment.payment_date.desc()).all()
-    return render_template('payments/my_payments.html', payments=payments)
+    return render_payments('payments/consumer_payments.html', buyer_id=session['user_id'])
 
 @app.route('/vendor_payments')
 @login_required(role='vendor')
 def vendor_payments():
-    user = User.query.get(session['user_id'])
-    vname = user.fullname or user.username
-    payments = Payment.query.join(Order, Payment.order_id == Order.id).filter(Order.vendor_name == vname).order_by(Payment.payment_date.desc()).all()
-    return render_template('payments/vendor_payments.html', payments=payments)
+    return render_payments('payments/vendor_payments.html', vendor_id=session['user_id'])
 
 @app.route('/admin_payments')
 @login_required(role='admin')
 def admin_payments():
-    payments = Payment.query.order_by(Payment.payment_date.desc()).all()
-    return render_template('payments/admin_payments.html', payments=payments)
+    return render_payments('payments/admin_payments.html')
 
 @app.route('/transactions')
 @login_required(role='consumer')
 def transactions():
-    uid = session.get('user_id')
-    txs = Payment.query.join(Order, Payment.order_id == Order.id).filter(Order.buyer_id == uid).order_by(Payment.payment_date.desc()).all()
-    return render_template('transaction_history.html', transactions=txs)
+    return render_payments('transaction_history.html', buyer_id=session['user_id'])
 
 # ---------- Address manager ----------
 @app.route('/addresses', methods=['GET','POST'])
@@ -504,94 +1396,413 @@ def address_delete(aid):
 # ---------- Reviews ----------
 @app.route('/reviews/<int:pid>', methods=['GET','POST'])
 def reviews(pid):
-    product = Product.query.get_or_404(pid)
+    product = cached_product(pid)
     if request.method=='POST':
         if 'user_id' not in session:
             flash('Please login to add a review','warning'); return redirect(url_for('login'))
-        rating = int(request.form.get('rating',5))
+        rating = min(max(request.form.get('rating', 5, type=int), 1), 5)
         review_text = request.form.get('review','').strip()
         r = ProductReview(user_id=session['user_id'], product_id=pid, rating=rating, review=review_text)
-        db.session.add(r); db.session.commit()
+        db.session.add(r)
+        # same transaction as the review, and relative to the stored values so concurrent posts can't be lost
+        db.session.execute(Product.__table__.update().where(Product.id == pid).values(
+            rating_count=Product.rating_count + 1, rating_sum=Product.rating_sum + rating,
+            rating_avg=(Product.rating_sum + rating) * 1.0 / (Product.rating_count + 1)))
+        bump_version('catalog')
+        db.session.commit()
+        cache.delete(f'rating:{pid}')
         log_action(session['user_id'], 'add_review', f'Review for product {pid}')
         flash('Review posted','success'); return redirect(url_for('reviews', pid=pid))
-    revs = ProductReview.query.filter_by(product_id=pid).order_by(ProductReview.created_at.desc()).all()
-    return render_template('reviews.html', product=product, reviews=revs)
+    cursor = request.args.get('cursor','').strip()
+    revs, next_cursor = review_page(pid, cursor, app.config['REVIEW_PAGE_SIZE'])
+    return render_template('reviews.html', product=product, reviews=revs, stats=rating_stats(pid),
+                           cursor=cursor, next_cursor=next_cursor)
 
 # ---------- Audit logs (admin) ----------
 @app.route('/audit_logs')
 @login_required(role='admin')
 def audit_logs():
-    logs = AuditLog.query.order_by(AuditLog.created_at.desc()).all()
-    return render_template('audit_logs.html', logs=logs)
+    actor = request.args.get('actor','').strip()
+    action = request.args.get('action','').strip()
+    start = parse_day(request.args.get('start','').strip())
+    end = parse_day(request.args.get('end','').strip())
+    month = request.args.get('archive','').strip()
+    cursor = request.args.get('cursor','').strip()
+    actor_id = None
+    if actor:
+        u = User.query.filter_by(username=actor).first()
+        actor_id = u.id if u else -1
+    limit = app.config['AUDIT_PAGE_SIZE']
+    months = audit_archive.list_months(app.config['AUDIT_ARCHIVE_DIR'])
+    if month in months:
+        def keep(r):
+            return ((actor_id is None or r.actor_id == actor_id) and (not action or r.action == action)
+                    and (not start or r.created_at >= start) and (not end or r.created_at < end + timedelta(days=1)))
+        rows = filter(keep, audit_archive.read_rows(app.config['AUDIT_ARCHIVE_DIR'], month))
+        logs, next_cursor = page_rows(rows, cursor, limit)
+    else:
+        month = ''
+        q = (db.session.query(AuditLog.id, AuditLog.actor_id, User.username.label('actor'), AuditLog.action,
+                              AuditLog.description, AuditLog.created_at)
+             .outerjoin(User, User.id == AuditLog.actor_id))
+        if actor_id is not None: q = q.filter(AuditLog.actor_id == actor_id)
+        if action: q = q.filter(AuditLog.action == action)
+        if start: q = q.filter(AuditLog.created_at >= start)
+        if end: q = q.filter(AuditLog.created_at < end + timedelta(days=1))
+        logs, next_cursor = keyset_page(q, AuditLog.created_at, AuditLog.id, cursor, limit)
+    filters = {'actor': actor, 'action': action, 'start': request.args.get('start',''),
+               'end': request.args.get('end',''), 'archive': month}
+    return render_template('audit_logs.html', logs=logs, filters=filters, months=months,
+                           cursor=cursor, next_cursor=next_cursor)
+
+def archive_audit_logs(retention_days):
+    """Move audit rows from whole months older than `retention_days` into gzip files; returns rows moved."""
+    from sqlalchemy import func
+    audit_sink.flush()
+    oldest_kept = datetime.utcnow() - timedelta(days=retention_days)
+    cutoff = datetime(oldest_kept.year, oldest_kept.month, 1)
+    moved = 0
+    while True:
+        first = db.session.query(func.min(AuditLog.created_at)).filter(AuditLog.created_at < cutoff).scalar()
+        if first is None:
+            break
+        month_start = datetime(first.year, first.month, 1)
+        month_end = datetime(first.year + first.month // 12, first.month % 12 + 1, 1)
+        in_month = (AuditLog.created_at >= month_start, AuditLog.created_at < month_end)
+        rows = (db.session.query(AuditLog.id, AuditLog.actor_id, User.username.label('actor'), AuditLog.action,
+                                 AuditLog.description, AuditLog.created_at)
+                .outerjoin(User, User.id == AuditLog.actor_id).filter(*in_month)
+                .order_by(AuditLog.id).execution_options(yield_per=1000))
+        moved += audit_archive.append_rows(app.config['AUDIT_ARCHIVE_DIR'], month_start.strftime('%Y-%m'),
+                                           (r._asdict() for r in rows))
+        AuditLog.query.filter(*in_month).delete(synchronize_session=False)
+        db.session.commit()
+    return moved
 
 # ---------- ADMIN DASHBOARD & REPORTS ----------
 @app.route('/admin')
 @login_required(role='admin')
 def admin_dashboard():
-    total_users = User.query.count(); total_products = Product.query.count(); total_orders = Order.query.count()
-    return render_template('admin_dashboard.html', total_users=total_users, total_products=total_products, total_orders=total_orders)
+    from sqlalchemy import func
+    total_users = User.query.count(); total_products = Product.query.count()
+    total_orders, total_revenue = db.session.query(func.sum(DailySales.order_count), func.sum(DailySales.revenue)).one()
+    return render_template('admin_dashboard.html', total_users=total_users, total_products=total_products,
+                           total_orders=total_orders or 0, total_revenue=total_revenue or 0)
 
 @app.route('/reports')
 @login_required()
 def reports():
     if session.get('role') not in ('admin','vendor'):
         flash('Access denied','danger'); return redirect(url_for('index'))
-    return render_template('reports.html')
+    vendors = User.query.filter_by(role='vendor').order_by(User.username).all() if session.get('role')=='admin' else []
+    return render_template('reports.html', vendors=vendors)
 
 @app.route('/reports/data')
 @login_required()
+@versioned('orders', extra=lambda: datetime.utcnow().date())  # the window ends today
 def reports_data():
-    role = session.get('role'); now = datetime.utcnow()
-    labels=[]; values=[]
     from sqlalchemy import func, desc
-    # daily revenue for last 7 days (based on orders and price_each*quantity, delivered)
-    for i in range(6,-1,-1):
-        dt = now - timedelta(days=i)
-        start = datetime(dt.year, dt.month, dt.day)
-        end = start + timedelta(days=1)
-        q = db.session.query(func.sum(Order.price_each*Order.quantity)).filter(Order.created_at>=start, Order.created_at<end, Order.status=='Delivered')
-        if role=='vendor':
-            user = User.query.get(session['user_id'])
-            q = q.filter(Order.vendor_name== (user.fullname or user.username))
-        total = q.scalar() or 0
-        labels.append(start.strftime('%Y-%m-%d')); values.append(float(total))
+    role = session.get('role'); now = datetime.utcnow()
+    days = request.args.get('days', 7, type=int)
+    if days not in REPORT_WINDOWS: days = 7
+    def scoped(q):
+        return q.filter(DailySales.vendor_id==session['user_id']) if role!='admin' else q
+    # daily delivered revenue for the window, read from the rollup
+    first = datetime(now.year, now.month, now.day) - timedelta(days=days-1)
+    daily_q = db.session.query(DailySales.day, func.sum(DailySales.revenue)).filter(DailySales.day>=first.date())
+    daily = {str(d): total for d, total in scoped(daily_q).group_by(DailySales.day).all()}
+    labels = [(first + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    values = [float(daily.get(l) or 0) for l in labels]
     # top products
-    if role=='admin':
-        top = db.session.query(Order.product_name, func.sum(Order.quantity).label('qty')).group_by(Order.product_name).order_by(desc('qty')).limit(5).all()
-    else:
-        user = User.query.get(session['user_id'])
-        top = db.session.query(Order.product_name, func.sum(Order.quantity).label('qty')).filter(Order.vendor_name==(user.fullname or user.username)).group_by(Order.product_name).order_by(desc('qty')).limit(5).all()
+    top = scoped(db.session.query(DailySales.product_name, func.sum(DailySales.quantity).label('qty'))).group_by(DailySales.product_name).order_by(desc('qty')).limit(5).all()
     top_list = [{'name': t[0], 'qty': int(t[1])} for t in top]
-    total_revenue_q = db.session.query(func.sum(Order.price_each*Order.quantity)).filter(Order.status=='Delivered')
-    if role=='vendor':
-        user = User.query.get(session['user_id']); total_revenue_q = total_revenue_q.filter(Order.vendor_name==(user.fullname or user.username))
-    total_revenue = float(total_revenue_q.scalar() or 0)
-    total_orders = Order.query.count() if role=='admin' else Order.query.filter(Order.vendor_name==(User.query.get(session['user_id']).fullname or User.query.get(session['user_id']).username)).count()
-    return jsonify({'labels':labels,'values':values,'top_products':top_list,'total_revenue':total_revenue,'total_orders':total_orders})
+    total_orders, total_revenue = scoped(db.session.query(func.sum(DailySales.order_count), func.sum(DailySales.revenue))).one()
+    return jsonify({'labels':labels,'values':values,'top_products':top_list,
+                    'total_revenue':float(total_revenue or 0),'total_orders':int(total_orders or 0),'days':days})
 
 @app.route('/reports/export_csv')
 @login_required()
 def export_csv():
-    si = io.StringIO(); cw = csv.writer(si)
-    cw.writerow(['Order ID','Product','Vendor','Buyer','Qty','Status','Price Each','Total','Date'])
-    q = Order.query.order_by(Order.created_at.desc())
-    for o in q.all():
-        buyer = User.query.get(o.buyer_id).username if o.buyer_id else ''
-        cw.writerow([o.id, o.product_name, o.vendor_name, buyer, o.quantity, o.status, o.price_each, round(o.price_each*o.quantity,2), o.created_at.strftime('%Y-%m-%d %H:%M')])
-    output = make_response(si.getvalue()); output.headers["Content-Disposition"] = "attachment; filename=sales.csv"; output.headers["Content-type"]="text/csv"
+    role = session.get('role')
+    if role not in ('admin','vendor'):
+        flash('Access denied','danger'); return redirect(url_for('index'))
+    start = parse_day(request.args.get('start','').strip())
+    end = parse_day(request.args.get('end','').strip())
+    vendor = session['user_id'] if role=='vendor' else request.args.get('vendor', type=int)
+    q = (db.session.query(Order.id, Order.product_name, Order.vendor_name, User.username, Order.quantity,
+                          Order.status, Order.price_each, Order.created_at)
+         .outerjoin(User, User.id == Order.buyer_id)
+         .order_by(Order.created_at.desc()))
+    if start: q = q.filter(Order.created_at >= start)
+    if end: q = q.filter(Order.created_at < end + timedelta(days=1))
+    if vendor: q = q.filter(Order.vendor_id == vendor)
+    q = q.execution_options(yield_per=1000)
+
+    def generate():
+        si = io.StringIO(); cw = csv.writer(si)
+        cw.writerow(['Order ID','Product','Vendor','Buyer','Qty','Status','Price Each','Total','Date'])
+        for n, (oid, pname, vname, buyer, qty, status, price, created) in enumerate(q, 1):
+            cw.writerow([oid, pname, vname, buyer or '', qty, status, price, round(price*qty,2),
+                         created.strftime('%Y-%m-%d %H:%M') if created else ''])
+            if n % 500 == 0:
+                yield si.getvalue(); si.seek(0); si.truncate()
+        yield si.getvalue()
+
+    output = Response(stream_with_context(generate()), mimetype='text/csv')
+    output.headers["Content-Disposition"] = "attachment; filename=sales.csv"
     return output
 
+# ---------- JSON API (v1) ----------
+# name -> (column, formatter); responses are built from the selected columns only, never from ORM objects
+def _iso(value):
+    return value.isoformat() if value else None
+
+API_PRODUCT_FIELDS = {
+    'id': (Product.id, None), 'name': (Product.name, None), 'price': (Product.price, None),
+    'quantity': (Product.quantity, None), 'description': (Product.description, None),
+    'image_url': (Product.image_path, lambda p: upload_url(p) if p else None),
+    'vendor_id': (Product.vendor_id, None), 'vendor_name': (db.func.coalesce(User.fullname, User.username), None),
+    'rating_avg': (Product.rating_avg, None), 'rating_count': (Product.rating_count, None),
+    'created_at': (Product.created_at, _iso),
+}
+API_PRODUCT_DEFAULT = ('id', 'name', 'price', 'quantity', 'image_url', 'vendor_name', 'rating_avg', 'rating_count')
+API_REVIEW_FIELDS = {
+    'id': (ProductReview.id, None), 'product_id': (ProductReview.product_id, None),
+    'rating': (ProductReview.rating, None), 'review': (ProductReview.review, None),
+    'user': (User.username, None), 'created_at': (ProductReview.created_at, _iso),
+}
+API_ORDER_FIELDS = {
+    'id': (Order.id, None), 'product_id': (Order.product_id, None), 'product_name': (Order.product_name, None),
+    'vendor_name': (Order.vendor_name, None), 'quantity': (Order.quantity, None),
+    'price_each': (Order.price_each, None), 'total': (Order.price_each * Order.quantity, lambda t: round(t, 2)),
+    'status': (Order.status, None), 'created_at': (Order.created_at, _iso),
+}
+
+def api_error(message, status=400):
+    abort(make_response(jsonify({'error': message}), status))
+
+def api_fields(spec, default=None):
+    names = [f.strip() for f in request.args.get('fields','').split(',') if f.strip()] or list(default or spec)
+    unknown = [n for n in names if n not in spec]
+    if unknown:
+        api_error(f"unknown field(s): {', '.join(unknown)}; choose from {', '.join(spec)}")
+    return names
+
+def api_select(spec, names, id_col, created_col):
+    """Column query for `names`, plus the id/created_at that cursor pagination needs."""
+    cols = [spec[n][0].label(n) for n in names if n not in ('id', 'created_at')]
+    return db.session.query(id_col.label('id'), created_col.label('created_at'), *cols)
+
+def api_rows(rows, spec, names):
+    out = []
+    for row in rows:
+        m = row._mapping
+        out.append({n: (spec[n][1](m[n]) if spec[n][1] and m[n] is not None else m[n]) for n in names})
+    return out
+
+def api_limit():
+    return min(max(request.args.get('limit', app.config['CATALOG_PAGE_SIZE'], type=int), 1), app.config['API_MAX_LIMIT'])
+
+@app.route('/api/v1/products')
+@versioned('catalog')
+def api_products():
+    """Catalog page (q, min, max, rating, sort=rating, cursor, limit) or a batch lookup with ids=1,2,3."""
+    names = api_fields(API_PRODUCT_FIELDS, API_PRODUCT_DEFAULT)
+    q = api_select(API_PRODUCT_FIELDS, names, Product.id, Product.created_at).select_from(Product)
+    if 'vendor_name' in names:
+        q = q.outerjoin(User, User.id == Product.vendor_id)
+    ids = request.args.get('ids','').strip()
+    if ids:
+        try:
+            wanted = list(dict.fromkeys(int(i) for i in ids.split(',') if i.strip()))
+        except ValueError:
+            api_error('ids must be a comma-separated list of integers')
+        if len(wanted) > app.config['API_MAX_LIMIT']:
+            api_error(f"at most {app.config['API_MAX_LIMIT']} ids per request")
+        found = {r.id: r for r in q.filter(Product.id.in_(wanted))}
+        return jsonify({'data': api_rows([found[i] for i in wanted if i in found], API_PRODUCT_FIELDS, names),
+                        'missing': [i for i in wanted if i not in found]})
+    rows, next_cursor = catalog_page(filter_catalog(q, request.args), request.args.get('q','').strip(),
+                                     request.args.get('sort','').strip(), request.args.get('cursor','').strip(), api_limit())
+    return jsonify({'data': api_rows(rows, API_PRODUCT_FIELDS, names), 'next_cursor': next_cursor})
+
+@app.route('/api/v1/products/<int:pid>')
+@versioned('catalog')
+def api_product(pid):
+    names = api_fields(API_PRODUCT_FIELDS, API_PRODUCT_DEFAULT)
+    q = api_select(API_PRODUCT_FIELDS, names, Product.id, Product.created_at).select_from(Product)
+    if 'vendor_name' in names:
+        q = q.outerjoin(User, User.id == Product.vendor_id)
+    row = q.filter(Product.id == pid).first()
+    if row is None:
+        api_error('product not found', 404)
+    return jsonify({'data': api_rows([row], API_PRODUCT_FIELDS, names)[0]})
+
+@app.route('/api/v1/products/<int:pid>/reviews')
+@versioned('catalog')
+def api_product_reviews(pid):
+    names = api_fields(API_REVIEW_FIELDS)
+    q = api_select(API_REVIEW_FIELDS, names, ProductReview.id, ProductReview.created_at).select_from(ProductReview)
+    if 'user' in names:
+        q = q.outerjoin(User, User.id == ProductReview.user_id)
+    rows, next_cursor = keyset_page(q.filter(ProductReview.product_id == pid), ProductReview.created_at,
+                                    ProductReview.id, request.args.get('cursor','').strip(), api_limit())
+    return jsonify({'data': api_rows(rows, API_REVIEW_FIELDS, names), 'next_cursor': next_cursor})
+
+@app.route('/api/v1/orders')
+@versioned('orders')
+def api_orders():
+    """The logged-in consumer's orders, newest first (status, cursor, limit)."""
+    if session.get('role') != 'consumer':
+        api_error('log in as a consumer', 401)
+    names = api_fields(API_ORDER_FIELDS)
+    q = api_select(API_ORDER_FIELDS, names, Order.id, Order.created_at).filter(Order.buyer_id == session['user_id'])
+    if request.args.get('status','').strip():
+        q = q.filter(Order.status == request.args['status'].strip())
+    rows, next_cursor = keyset_page(q, Order.created_at, Order.id, request.args.get('cursor','').strip(), api_limit())
+    return jsonify({'data': api_rows(rows, API_ORDER_FIELDS, names), 'next_cursor': next_cursor})
+
 # ---------- Utility / debug routes ----------
+@app.route('/metrics')
+def metrics():
+    if not app.config['INSTRUMENTATION']:
+        abort(404)
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/whoami')
 def whoami():
     if 'user_id' in session:
         return jsonify({'user_id': session['user_id'], 'username': session.get('username'), 'role': session.get('role')})
     return jsonify({'user': None})
 
+# ---------- DB SETUP ----------
+def init_db():
+    """Create missing tables, columns and indexes (safe to run on an existing database)."""
+    db.create_all()
+    added = add_missing_columns()
+    for t in db.metadata.sorted_tables:
+        for index in t.indexes:
+            index.create(db.engine, checkfirst=True)
+    init_search_index()
+    backfill_order_vendors()
+    backfill_item_names()
+    if ('products', 'rating_count') in added:
+        rebuild_rating_summaries()
+    if not DailySales.query.first() and Order.query.first():
+        rebuild_daily_sales()
+
+def add_missing_columns():
+    # create_all() never alters existing tables; add columns introduced after a database was created
+    from sqlalchemy import inspect
+    insp = inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for t in db.metadata.sorted_tables:
+            existing = {c['name'] for c in insp.get_columns(t.name)}
+            for col in t.columns:
+                if col.name not in existing:
+                    ddl = col.type.compile(dialect=db.engine.dialect)
+                    default = col.default.arg if col.default is not None and col.default.is_scalar else None
+                    if isinstance(default, (int, float)) and not isinstance(default, bool):
+                        ddl += f' DEFAULT {default}'
+                    conn.exec_driver_sql(f'ALTER TABLE {t.name} ADD COLUMN {col.name} {ddl}')
+                    added.append((t.name, col.name))
+    return added
+
+def rebuild_rating_summaries():
+    """Recompute products.rating_count/sum/avg from product_reviews."""
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("""UPDATE products SET
+            rating_count = (SELECT COUNT(rating) FROM product_reviews WHERE product_id = products.id),
+            rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM product_reviews WHERE product_id = products.id),
+            rating_avg = (SELECT COALESCE(AVG(rating), 0) FROM product_reviews WHERE product_id = products.id)""")
+
+def backfill_item_names():
+    # legacy orders hold exactly one item, so the order's snapshot name is the item's
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("""UPDATE order_items SET product_name =
+            (SELECT orders.product_name FROM orders WHERE orders.id = order_items.order_id)
+            WHERE product_name IS NULL""")
+
+def backfill_order_vendors():
+    """Fill orders.vendor_id from the ordered product, or from vendor_name when the product is gone."""
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("""UPDATE orders SET vendor_id =
+            (SELECT products.vendor_id FROM products WHERE products.id = orders.product_id)
+            WHERE vendor_id IS NULL""")
+        conn.exec_driver_sql("""UPDATE orders SET vendor_id =
+            (SELECT MIN(users.id) FROM users WHERE users.role = 'vendor'
+             AND COALESCE(NULLIF(users.fullname, ''), users.username) = orders.vendor_name)
+            WHERE vendor_id IS NULL""")
+
+def init_search_index(rebuild=False):
+    """Create the products_fts index and its triggers; fill it on first creation or when asked."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        exists = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name='products_fts'").first()
+        for ddl in PRODUCT_FTS_DDL:
+            conn.exec_driver_sql(ddl)
+        if rebuild or not exists:
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+            # weight name matches above description matches
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+@app.cli.command('init-db')
+def init_db_command():
+    init_db(); print('Database ready.')
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    init_search_index(rebuild=True); print('Search index rebuilt.')
+
+@app.cli.command('archive-audit-logs')
+@click.option('--days', type=int, default=None, help='Keep this many days in the database (default AUDIT_RETENTION_DAYS).')
+def archive_audit_logs_command(days):
+    moved = archive_audit_logs(days if days is not None else app.config['AUDIT_RETENTION_DAYS'])
+    print(f'Archived {moved} audit log rows.')
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Create resized variants for product images uploaded before the image pipeline existed."""
+    done = 0
+    for p in Product.query.filter(Product.image_path.isnot(None), Product.image_variants.isnot(True)).all():
+        src = os.path.join(app.static_folder, p.image_path)
+        if not os.path.exists(src):
+            continue
+        with open(src, 'rb') as fh:
+            make_variants(fh.read(), src)
+        p.image_variants = True; done += 1
+    db.session.commit(); print(f'Built variants for {done} product images.')
+
+@app.cli.command('release-reservations')
+def release_reservations_command():
+    print(f'Released {release_expired_reservations()} expired reservations.')
+
+@app.cli.command('settle-payments')
+def settle_payments_command():
+    # picks up payments left Pending by a restart; the gateway dedupes on the idempotency key
+    pending = [pid for pid, method in db.session.query(Payment.id, Payment.payment_method)
+               .filter(Payment.payment_status == 'Pending') if not is_cod(method)]
+    for pid in pending:
+        settle_payment(pid)
+    print(f'Settled {len(pending)} pending payments.')
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    rebuild_rating_summaries(); print('Product rating summaries rebuilt.')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    rebuild_daily_sales(); print('Daily sales rollup rebuilt.')
+
 # ---------- START ----------
 if __name__=='__main__':
     # ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(debug=True)
@@ -0,0 +1,50 @@
+"""Monthly gzip archives for audit log rows.
+
+Each month lives in `<archive_dir>/YYYY-MM.jsonl.gz`, one JSON object per
+row. Archiving the same month again appends a new gzip member, which
+readers see as one continuous stream.
+"""
+import gzip
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+FIELDS = ('id', 'actor_id', 'actor', 'action', 'description', 'created_at')
+
+
+def month_path(archive_dir, month):
+    return os.path.join(archive_dir, f'{month}.jsonl.gz')
+
+
+def list_months(archive_dir):
+    """Archived months, newest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    names = [n[:-len('.jsonl.gz')] for n in os.listdir(archive_dir) if n.endswith('.jsonl.gz')]
+    return sorted(names, reverse=True)
+
+
+def append_rows(archive_dir, month, rows):
+    """Append row dicts (FIELDS, created_at as datetime) to the month's archive; returns the count."""
+    os.makedirs(archive_dir, exist_ok=True)
+    n = 0
+    with gzip.open(month_path(archive_dir, month), 'at', encoding='utf-8') as fh:
+        for row in rows:
+            rec = {k: row[k] for k in FIELDS}
+            rec['created_at'] = row['created_at'].isoformat() if row['created_at'] else None
+            fh.write(json.dumps(rec, separators=(',', ':')) + '\n')
+            n += 1
+    return n
+
+
+def read_rows(archive_dir, month):
+    """Yield archived rows as attribute objects shaped like the live audit log query rows."""
+    path = month_path(archive_dir, month)
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            rec = json.loads(line)
+            rec['created_at'] = datetime.fromisoformat(rec['created_at']) if rec['created_at'] else None
+            yield SimpleNamespace(**rec)
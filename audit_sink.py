@@ -0,0 +1,88 @@
+"""Buffered audit log writer.
+
+log_action() used to add an AuditLog row and commit on the request path.
+AuditSink takes rows off the request thread instead: they are queued in
+process and a background thread hands them to `write_batch` in batches,
+whenever `batch_size` rows are waiting or `flush_interval` seconds have
+passed. In sync mode every row is written immediately (tests, scripts).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class AuditSink:
+    def __init__(self, write_batch, batch_size=100, flush_interval=1.0, sync=False):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def submit(self, row):
+        if self.sync:
+            self._write([row])
+            return
+        self._ensure_started()
+        self._queue.put(row)
+
+    def flush(self):
+        """Write everything queued so far on the calling thread."""
+        rows = self._drain()
+        while rows:
+            self._write(rows)
+            rows = self._drain()
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval * 2, 5))
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-sink', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _drain(self):
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                rows = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(rows)
+
+    def _write(self, rows):
+        try:
+            self.write_batch(rows)
+        except Exception:
+            log.exception('dropped %d audit log rows', len(rows))
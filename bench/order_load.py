@@ -0,0 +1,89 @@
+"""Concurrent order load test: many buyers racing for one product's stock.
+
+Runs against a throwaway copy of the database, never the real one:
+
+    python bench/order_load.py --orders 400 --threads 32 --stock 150
+
+Each worker thread uses its own Flask test client logged in as its own
+consumer and POSTs /order/<pid>. Prints a JSON summary; exits non-zero if
+more units were sold than were in stock.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--orders', type=int, default=400, help='total order attempts')
+    ap.add_argument('--threads', type=int, default=32)
+    ap.add_argument('--stock', type=int, default=150, help='units in stock at the start')
+    ap.add_argument('--qty', type=int, default=1, help='units per order')
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='order-load-')
+    shutil.copy(os.path.join(ROOT, 'marine_marketplace.db'), os.path.join(workdir, 'load.db'))
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ.setdefault('AUDIT_LOG_MODE', 'async')
+    sys.path.insert(0, ROOT)
+    import app as marketplace
+    from app import app, db, init_db, User, Product, Order
+
+    with app.app_context():
+        init_db()
+        vendor = User(username='load-vendor', password='x', role='vendor')
+        buyers = [User(username=f'load-buyer-{i}', password='x', role='consumer') for i in range(args.threads)]
+        db.session.add_all([vendor] + buyers); db.session.flush()
+        product = Product(name='Load test catch', price=100.0, quantity=args.stock, vendor_id=vendor.id)
+        db.session.add(product); db.session.commit()
+        pid = product.id
+        buyer_ids = [(b.id, b.username) for b in buyers]
+
+    counts = {'placed': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    per_thread = [args.orders // args.threads + (1 if i < args.orders % args.threads else 0)
+                  for i in range(args.threads)]
+
+    def worker(i):
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'], s['username'] = buyer_ids[i]
+            s['role'] = 'consumer'
+        for _ in range(per_thread[i]):
+            r = client.post(f'/order/{pid}', data={'quantity': args.qty})
+            key = 'errors' if r.status_code >= 500 else \
+                  'placed' if '/pay/' in r.headers.get('Location', '') else 'rejected'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        left = db.session.get(Product, pid).quantity
+        ordered = db.session.query(db.func.coalesce(db.func.sum(Order.quantity), 0)).filter(Order.product_id == pid).scalar()
+    marketplace.audit_sink.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    oversold = max(0, ordered - args.stock)
+    print(json.dumps({
+        'attempts': args.orders, 'threads': args.threads, 'initial_stock': args.stock,
+        **counts, 'units_ordered': ordered, 'stock_left': left,
+        'oversold_units': oversold, 'consistent': ordered + left == args.stock,
+        'seconds': round(elapsed, 3), 'orders_per_sec': round(args.orders / elapsed, 1),
+    }, indent=2))
+    return 1 if oversold or ordered + left != args.stock or counts['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
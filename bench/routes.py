@@ -0,0 +1,154 @@
+"""Route latency benchmark: times the key pages with the Flask test client.
+
+Run it against a database made by bench/seed_data.py. The file is copied to a
+temp dir first, because the `order` route writes:
+
+    python bench/seed_data.py --rows 100k --out bench/bench-100k.db
+    python bench/routes.py --db bench/bench-100k.db --requests 50 --out run.json
+    python bench/routes.py --db bench/bench-100k.db --baseline run.json
+
+For each route it reports:
+- p50/p95/p99/mean latency in ms over --requests timed calls, after one warm-up call;
+- SQL statements per request;
+- peak Python heap for one extra call traced with tracemalloc.
+
+The report is JSON. With --baseline, it adds the p95 change against an
+earlier report, and the exit status is 1 if any route's p95 got worse by
+more than --threshold percent.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (role, method, url, form); {pid} is filled with an in-stock product
+ROUTES = {
+    'marketplace': ('anonymous', 'GET', '/marketplace', None),
+    'marketplace_search': ('anonymous', 'GET', '/marketplace?q=bangus', None),
+    'orders': ('vendor', 'GET', '/orders', None),
+    'reports_data': ('admin', 'GET', '/reports/data?days=30', None),
+    'export_csv': ('admin', 'GET', '/reports/export_csv', None),
+    'audit_logs': ('admin', 'GET', '/audit_logs', None),
+    'order': ('consumer', 'POST', '/order/{pid}', {'quantity': '1'}),
+}
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--db', default=os.path.join(ROOT, 'bench', 'bench.db'), help='database from seed_data.py')
+    ap.add_argument('--requests', type=int, default=30, help='timed requests per route')
+    ap.add_argument('--routes', default=','.join(ROUTES), help='comma-separated subset of: ' + ', '.join(ROUTES))
+    ap.add_argument('--out', help='also write the JSON report here')
+    ap.add_argument('--baseline', help='earlier JSON report to compare p95 against')
+    ap.add_argument('--threshold', type=float, default=20.0, help='allowed p95 regression in percent')
+    args = ap.parse_args()
+    names = [n.strip() for n in args.routes.split(',') if n.strip()]
+    unknown = set(names) - set(ROUTES)
+    if unknown:
+        sys.exit(f'unknown routes: {", ".join(sorted(unknown))}')
+
+    workdir = tempfile.mkdtemp(prefix='route-bench-')
+    shutil.copy(args.db, os.path.join(workdir, 'bench.db'))
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('AUDIT_LOG_MODE', 'async')
+    sys.path.insert(0, ROOT)
+    import app as marketplace
+    from app import app, db, init_db, User, Product
+    from sqlalchemy import event
+
+    with app.app_context():
+        init_db()
+        users = {role: db.session.query(User.id, User.username).filter(User.role == role).order_by(User.id).first()
+                 for role in ('admin', 'vendor', 'consumer')}
+        pid = db.session.query(Product.id).order_by(Product.quantity.desc()).limit(1).scalar()
+        engine = db.engine
+
+    queries = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(*_):
+        queries[0] += 1
+
+    clients = {}
+    def client_for(role):
+        if role not in clients:
+            c = clients[role] = app.test_client()
+            if role != 'anonymous':
+                if users.get(role) is None:
+                    return None
+                with c.session_transaction() as s:
+                    s['user_id'], s['username'] = users[role]
+                    s['role'] = role
+        return clients[role]
+
+    def call(c, method, url, form):
+        r = c.open(url, method=method, data=form)
+        r.get_data()  # drain streamed bodies (export_csv)
+        return r.status_code
+
+    report = {'db': os.path.abspath(args.db), 'requests': args.requests, 'routes': {}}
+    for name in names:
+        role, method, url, form = ROUTES[name]
+        c = client_for(role)
+        if c is None:
+            report['routes'][name] = {'skipped': f'no {role} user in this database'}
+            continue
+        url = url.format(pid=pid)
+        status = call(c, method, url, form)  # warm-up
+        timings, counts = [], []
+        for _ in range(args.requests):
+            queries[0] = 0
+            t0 = time.perf_counter()
+            call(c, method, url, form)
+            timings.append((time.perf_counter() - t0) * 1000)
+            counts.append(queries[0])
+        tracemalloc.start()
+        call(c, method, url, form)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings.sort()
+        report['routes'][name] = {
+            'status': status,
+            'p50_ms': round(percentile(timings, 50), 2), 'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2), 'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries': max(counts), 'peak_kib': round(peak / 1024, 1),
+        }
+    marketplace.audit_sink.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    regressed = []
+    if args.baseline:
+        with open(args.baseline) as fh:
+            before = json.load(fh)['routes']
+        for name, r in report['routes'].items():
+            old = before.get(name, {}).get('p95_ms')
+            if old and 'p95_ms' in r:
+                r['p95_change_pct'] = round((r['p95_ms'] - old) / old * 100, 1)
+                if r['p95_change_pct'] > args.threshold:
+                    regressed.append(name)
+        report['regressed'] = regressed
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(text + '\n')
+    print(text)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""Synthetic marketplace data for benchmarks: users, products, orders, payments, reviews, audit logs.
+
+Builds a new SQLite database (never touches marine_marketplace.db):
+
+    python bench/seed_data.py --rows 100k --out bench/bench-100k.db
+
+--rows is the approximate total across all tables (10k .. 10M; k/M suffixes
+accepted) and is split using SHARES. Generation is deterministic for a given
+--seed. Rows are written with batched executemany in one transaction per
+table, then the rating summaries, search index and sales rollup are rebuilt
+the same way `flask init-db` / `rebuild-*` would.
+
+All generated accounts share the password 'bench'.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# fraction of --rows per table
+SHARES = {'users': 0.02, 'products': 0.04, 'orders': 0.22, 'order_items': 0.22,
+          'payments': 0.18, 'reviews': 0.12, 'audit_logs': 0.20}
+VENDOR_SHARE = 0.1  # of users; one admin, the rest consumers
+BATCH = 10000
+
+FISH = ['Bangus', 'Tilapia', 'Galunggong', 'Tuna', 'Lapu-lapu', 'Maya-maya', 'Tamban', 'Dilis',
+        'Hipon', 'Alimango', 'Pusit', 'Tahong', 'Talaba', 'Sugpo', 'Dalagang-bukid', 'Tanigue']
+STYLES = ['Fresh', 'Frozen', 'Smoked', 'Dried', 'Marinated', 'Boneless', 'Whole', 'Fillet']
+PLACES = ['Dagupan', 'Navotas', 'Batangas', 'Iloilo', 'Zamboanga', 'Bohol', 'Quezon', 'Cebu']
+STATUSES = ['Pending', 'Paid', 'Processing', 'Shipped', 'Delivered', 'Delivered', 'Delivered', 'Cancelled']
+ACTIONS = ['login', 'logout', 'create_order', 'payment', 'add_review', 'update_order', 'add_product']
+REVIEWS = ['Very fresh', 'Good value', 'Arrived late', 'Will order again', 'Smaller than expected', 'Excellent']
+
+
+def parse_rows(value):
+    value = value.strip().lower()
+    mult = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * mult)
+
+
+def batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--rows', default='10k', help='approximate total rows, e.g. 10k, 250k, 10M')
+    ap.add_argument('--out', default=os.path.join(ROOT, 'bench', 'bench.db'), help='SQLite file to create')
+    ap.add_argument('--days', type=int, default=365, help='spread created_at over this many days back')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--force', action='store_true', help='overwrite --out if it exists')
+    args = ap.parse_args()
+
+    total = parse_rows(args.rows)
+    counts = {t: max(1, int(total * share)) for t, share in SHARES.items()}
+    counts['users'] = max(counts['users'], 10)
+    if os.path.exists(args.out):
+        if not args.force:
+            sys.exit(f'{args.out} exists; pass --force to overwrite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.out)}'
+    os.environ.setdefault('AUDIT_LOG_MODE', 'sync')
+    sys.path.insert(0, ROOT)
+    import app as marketplace
+    from app import app, db, init_db, User, Product, Order, OrderItem, Payment, ProductReview, AuditLog
+    from werkzeug.security import generate_password_hash
+
+    rnd = random.Random(args.seed)
+    now = datetime.utcnow()
+    span = args.days * 86400
+
+    def when():
+        return now - timedelta(seconds=rnd.randrange(span))
+
+    timings = {}
+    started = time.perf_counter()
+    with app.app_context():
+        init_db()
+
+        def insert(model, rows):
+            t0 = time.perf_counter()
+            n = 0
+            conn = db.session.connection()
+            for batch in batched(rows):
+                conn.execute(model.__table__.insert(), batch)
+                n += len(batch)
+            db.session.commit()
+            timings[model.__tablename__] = round(time.perf_counter() - t0, 2)
+            return n
+
+        password = generate_password_hash('bench')
+        n_users = counts['users']
+        n_vendors = max(1, int(n_users * VENDOR_SHARE))
+        # id 1 = admin, 2..n_vendors+1 = vendors, rest consumers (on a fresh file ids start at 1)
+        insert(User, ({'id': i, 'username': f'bench-{role}-{i}@marine.test', 'password': password,
+                       'fullname': f'Bench {role.title()} {i}', 'role': role, 'created_at': when()}
+                      for i in range(1, n_users + 1)
+                      for role in ['admin' if i == 1 else 'vendor' if i <= n_vendors + 1 else 'consumer']))
+        vendors = range(2, n_vendors + 2)
+        consumers = range(n_vendors + 2, n_users + 1) or vendors
+
+        products = []
+        for pid in range(1, counts['products'] + 1):
+            name = f'{rnd.choice(STYLES)} {rnd.choice(FISH)}'
+            products.append((pid, name, round(rnd.uniform(60, 900), 2), rnd.choice(vendors)))
+        insert(Product, ({'id': pid, 'name': name, 'price': price, 'quantity': rnd.randrange(0, 500),
+                          'description': f'{name} from {rnd.choice(PLACES)}, per kg', 'vendor_id': vendor,
+                          'created_at': when()}
+                         for pid, name, price, vendor in products))
+
+        n_orders = counts['orders']
+        def order_rows():
+            for oid in range(1, n_orders + 1):
+                pid, name, price, vendor = rnd.choice(products)
+                qty = rnd.randint(1, 10)
+                created = when()
+                yield {'id': oid, 'product_id': pid, 'product_name': name, 'vendor_name': f'Bench Vendor {vendor}',
+                       'vendor_id': vendor, 'buyer_id': rnd.choice(consumers), 'quantity': qty,
+                       'price_each': price, 'status': rnd.choice(STATUSES), 'created_at': created}
+        insert(Order, order_rows())
+        # one line per order (mirrors /order); any surplus share becomes extra lines on random orders
+        def item_rows():
+            for n in range(counts['order_items']):
+                oid = n + 1 if n < n_orders else rnd.randrange(1, n_orders + 1)
+                pid, name, price, _ = rnd.choice(products)
+                qty = rnd.randint(1, 10)
+                yield {'order_id': oid, 'product_id': pid, 'product_name': name, 'quantity': qty,
+                       'price_each': price, 'subtotal': round(price * qty, 2)}
+        insert(OrderItem, item_rows())
+        # stream orders back rather than holding millions of them in memory; pays ~payments/orders of them
+        paid_share = min(1.0, counts['payments'] / n_orders)
+        with db.engine.connect() as reader:
+            placed = reader.execution_options(yield_per=BATCH).execute(
+                db.select(Order.id, Order.created_at, Order.price_each * Order.quantity).order_by(Order.id))
+            insert(Payment, ({'order_id': oid, 'amount_paid': round(total, 2), 'payment_method': method,
+                              'payment_status': 'Pending' if marketplace.is_cod(method) else 'Completed',
+                              'payment_date': created + timedelta(minutes=rnd.randrange(5, 600))}
+                             for oid, created, total in placed if rnd.random() < paid_share
+                             for method in [rnd.choice(marketplace.PAYMENT_METHODS)]))
+        insert(ProductReview, ({'user_id': rnd.choice(consumers), 'product_id': rnd.randrange(1, len(products) + 1),
+                                'rating': rnd.choices(range(1, 6), weights=(1, 1, 2, 4, 5))[0],
+                                'review': rnd.choice(REVIEWS), 'created_at': when()}
+                               for _ in range(counts['reviews'])))
+        insert(AuditLog, ({'actor_id': rnd.randrange(1, n_users + 1), 'action': action,
+                           'description': f'{action} (generated)', 'created_at': when()}
+                          for _ in range(counts['audit_logs']) for action in [rnd.choice(ACTIONS)]))
+
+        t0 = time.perf_counter()
+        marketplace.rebuild_rating_summaries()
+        marketplace.init_search_index(rebuild=True)
+        marketplace.rebuild_daily_sales()
+        timings['derived'] = round(time.perf_counter() - t0, 2)
+        actual = {m.__tablename__: db.session.query(m).count()
+                  for m in (User, Product, Order, OrderItem, Payment, ProductReview, AuditLog)}
+        db.session.commit()
+        db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+
+    print(json.dumps({'db': os.path.abspath(args.out), 'seed': args.seed, 'rows': actual,
+                      'seconds': round(time.perf_counter() - started, 2), 'phase_seconds': timings}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
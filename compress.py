@@ -0,0 +1,46 @@
+"""Response compression for HTML/JSON/text bodies.
+
+Brotli is used when the `brotli` package is installed and the client asks
+for it, gzip otherwise. Streamed and file responses are left alone, as is
+anything already encoded or too small to be worth it.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'application/json', 'text/plain', 'text/css', 'application/javascript'}
+# ETag suffix per encoding, so each representation gets its own strong validator
+SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+
+
+def pick_encoding(accept_encoding):
+    """'br', 'gzip' or None for a werkzeug Accept-Encoding header."""
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(resp, accept_encoding, min_size=500, level=6):
+    resp.vary.add('Accept-Encoding')
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or 'Content-Encoding' in resp.headers or resp.mimetype not in COMPRESSIBLE):
+        return resp
+    encoding = pick_encoding(accept_encoding)
+    data = resp.get_data()
+    if encoding is None or len(data) < min_size:
+        return resp
+    if encoding == 'br':
+        body = brotli.compress(data, quality=min(level, 11))
+    else:
+        body = gzip.compress(data, compresslevel=level, mtime=0)
+    resp.set_data(body)
+    resp.headers['Content-Encoding'] = encoding
+    etag, weak = resp.get_etag()
+    if etag:
+        resp.set_etag(etag + SUFFIXES[encoding], weak=weak)
+    return resp
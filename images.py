@@ -0,0 +1,77 @@
+"""Resized WebP/JPEG variants for uploaded product images.
+
+An upload is decoded once, EXIF-rotated and stripped, then written as
+`<stem>_<variant>.webp` and `<stem>_<variant>.jpg` next to the original for
+every entry in VARIANTS. ImagePipeline runs that work on a thread pool so
+the request only has to store the original bytes.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+log = logging.getLogger(__name__)
+
+# variant name -> longest edge in pixels, smallest first
+VARIANTS = {'thumb': 160, 'card': 480, 'full': 1200}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+
+
+def variant_path(image_path, variant, fmt):
+    """'uploads/x.png' -> 'uploads/x_card.webp' (works for filesystem and static paths)."""
+    stem, _ = os.path.splitext(image_path)
+    return f'{stem}_{variant}.{fmt}'
+
+
+def make_variants(data, original_path):
+    """Decode `data` once and write every variant beside `original_path`."""
+    with Image.open(io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+            im = _flatten(im)
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+        for variant, edge in VARIANTS.items():
+            resized = im.copy()
+            resized.thumbnail((edge, edge), Image.LANCZOS)
+            for fmt, (pil_format, options) in FORMATS.items():
+                # saving from pixel data only, so no EXIF/GPS metadata is carried over
+                resized.save(variant_path(original_path, variant, fmt), pil_format, **options)
+
+
+def _flatten(im):
+    # JPEG has no alpha channel: composite transparent images onto white
+    rgba = im.convert('RGBA')
+    bg = Image.new('RGB', rgba.size, (255, 255, 255))
+    bg.paste(rgba, mask=rgba.split()[-1])
+    return bg
+
+
+class ImagePipeline:
+    """Runs make_variants() on `workers` threads (0 = inline) and calls `on_done(key)` on success."""
+
+    def __init__(self, workers=2, on_done=None):
+        self.on_done = on_done
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images') if workers else None
+
+    def submit(self, data, original_path, key=None):
+        if self._pool is None:
+            self._process(data, original_path, key)
+            return None
+        return self._pool.submit(self._process, data, original_path, key)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def _process(self, data, original_path, key):
+        try:
+            make_variants(data, original_path)
+        except Exception:
+            log.exception('could not build image variants for %s', original_path)
+            return
+        if self.on_done is not None:
+            self.on_done(key)
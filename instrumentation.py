@@ -0,0 +1,151 @@
+"""Per-request profiling: SQL counts and time, template render time, slow logs, Prometheus metrics.
+
+Instrumentation(app).install() hooks SQLAlchemy cursor events and Flask
+request/template signals. Every response then carries a Server-Timing header:
+
+    Server-Timing: db;dur=12.3;desc="7 queries", render;dur=4.1, app;dur=20.9
+
+Statements slower than slow_query_ms are logged with their SQL and the
+first application frame that issued them. Requests slower than
+slow_request_ms are logged too. Latencies feed per-endpoint histograms,
+which render_metrics() returns in Prometheus text format.
+
+Nothing is hooked unless install() is called, so a disabled build pays
+nothing. Metrics are per process: scrape each worker, or sum them upstream.
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SKIP = (os.sep + 'site-packages' + os.sep, os.sep + 'lib' + os.sep + 'python', __file__)
+
+
+def call_site():
+    """'file.py:123 in func' for the innermost frame outside libraries and this module."""
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if not any(s in frame.filename for s in _SKIP):
+            return f'{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}'
+    return '?'
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Instrumentation:
+    def __init__(self, app, slow_query_ms=100, slow_request_ms=500):
+        self.app = app
+        self.slow_query_ms = slow_query_ms
+        self.slow_request_ms = slow_request_ms
+        self._lock = threading.Lock()
+        self._latency = {}   # (endpoint, method, status) -> Histogram
+        self._queries = {}   # endpoint -> [statements, db seconds]
+
+    def install(self):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor)
+        before_render_template.connect(self._before_render, self.app)
+        template_rendered.connect(self._after_render, self.app)
+        self.app.before_request(self._start)
+        self.app.after_request(self._finish)
+        return self
+
+    # ---- SQLAlchemy events ----
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if has_request_context() and 'req_start' in g:
+            g.db_queries += 1
+            g.db_time += elapsed
+        if elapsed * 1000 >= self.slow_query_ms:
+            log.warning('slow query %.1fms at %s: %s', elapsed * 1000, call_site(), ' '.join(statement.split()))
+
+    # ---- template signals ----
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context() and 'req_start' in g:
+            g.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and g.get('render_started'):
+            g.render_time += time.perf_counter() - g.render_started
+            g.render_started = None
+
+    # ---- request hooks ----
+    def _start(self):
+        g.req_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0.0
+        g.render_time = 0.0
+        g.render_started = None
+
+    def _finish(self, resp):
+        if 'req_start' not in g:
+            return resp
+        stats = g._get_current_object()
+        resp.headers.add('Server-Timing', f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_queries} queries"')
+        resp.headers.add('Server-Timing', f'render;dur={stats.render_time * 1000:.1f}')
+        resp.headers.add('Server-Timing', f'app;dur={(time.perf_counter() - stats.req_start) * 1000:.1f}')
+        args = (stats, request.endpoint or 'unmatched', request.method, request.full_path, resp.status_code)
+        if resp.is_streamed:
+            # streamed bodies (CSV export) are produced after this hook; record them once fully sent
+            resp.call_on_close(lambda: self._record(*args))
+        else:
+            self._record(*args)
+        return resp
+
+    def _record(self, stats, endpoint, method, path, status):
+        total = time.perf_counter() - stats.req_start
+        with self._lock:
+            self._latency.setdefault((endpoint, method, status), Histogram()).observe(total)
+            q = self._queries.setdefault(endpoint, [0, 0.0])
+            q[0] += stats.db_queries
+            q[1] += stats.db_time
+        if total * 1000 >= self.slow_request_ms:
+            log.warning('slow request %.1fms %s %s (%d queries, %.1fms db, %.1fms render)', total * 1000,
+                        method, path, stats.db_queries, stats.db_time * 1000, stats.render_time * 1000)
+
+    def render_metrics(self):
+        lines = ['# HELP http_request_duration_seconds Time spent handling requests, by endpoint.',
+                 '# TYPE http_request_duration_seconds histogram']
+        with self._lock:
+            latency = sorted(self._latency.items())
+            queries = sorted(self._queries.items())
+            for (endpoint, method, status), h in latency:
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ('+Inf',), h.counts):
+                    cumulative += n
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {h.sum:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {h.count}')
+            lines += ['# HELP db_queries_total SQL statements executed while handling requests, by endpoint.',
+                      '# TYPE db_queries_total counter']
+            lines += [f'db_queries_total{{endpoint="{e}"}} {n}' for e, (n, _) in queries]
+            lines += ['# HELP db_query_seconds_total Time spent in SQL while handling requests, by endpoint.',
+                      '# TYPE db_query_seconds_total counter']
+            lines += [f'db_query_seconds_total{{endpoint="{e}"}} {t:.6f}' for e, (_, t) in queries]
+        return '\n'.join(lines) + '\n'
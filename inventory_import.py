@@ -0,0 +1,68 @@
+"""Parsing and validation for bulk product imports (CSV or JSON).
+
+Each input row may carry: id, name, price, quantity, add_quantity,
+description. read_csv()/read_json() yield (row_number, raw dict) lazily;
+parse_row() turns a raw dict into typed values plus a list of error messages.
+Which rows create and which update products is decided by the caller, which
+knows the vendor's existing catalogue.
+"""
+import csv
+import io
+import math
+
+FIELDS = ('id', 'name', 'price', 'quantity', 'add_quantity', 'description')
+MAX_NAME = 200
+MAX_DESCRIPTION = 400
+
+
+def read_csv(stream):
+    """Rows of an uploaded CSV file (binary stream); row numbers match spreadsheet lines."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for n, row in enumerate(reader, 2):  # line 1 is the header
+        yield n, {(k or '').strip().lower(): v for k, v in row.items()}
+
+
+def read_json(data):
+    """Rows of a JSON body: a list of objects, or {"rows": [...]}; numbered from 1."""
+    rows = data.get('rows') if isinstance(data, dict) else data
+    if not isinstance(rows, list):
+        raise ValueError('expected a list of rows or {"rows": [...]}')
+    for n, row in enumerate(rows, 1):
+        yield n, row if isinstance(row, dict) else {'_invalid': row}
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_row(raw):
+    """(values, errors): values only holds the fields present in the row, converted to their types."""
+    values, errors = {}, []
+    if '_invalid' in raw:
+        return values, ['row is not an object']
+    unknown = sorted(k for k in raw if k and k not in FIELDS)
+    if unknown:
+        errors.append(f'unknown column(s): {", ".join(unknown)}')
+    for field, kind in (('id', int), ('quantity', int), ('add_quantity', int), ('price', float)):
+        if _blank(raw.get(field)):
+            continue
+        try:
+            value = kind(str(raw[field]).strip())
+        except ValueError:
+            errors.append(f'{field} must be a {"number" if kind is float else "whole number"}')
+            continue
+        if not math.isfinite(value) or value < 0:
+            errors.append(f'{field} must be zero or more')
+            continue
+        values[field] = value
+    for field, limit in (('name', MAX_NAME), ('description', MAX_DESCRIPTION)):
+        if not _blank(raw.get(field)):
+            text = str(raw[field]).strip()
+            if len(text) > limit:
+                errors.append(f'{field} is longer than {limit} characters')
+            values[field] = text[:limit]
+    if 'quantity' in values and 'add_quantity' in values:
+        errors.append('give either quantity or add_quantity, not both')
+    if 'id' not in values and 'name' not in values:
+        errors.append('id or name is required')
+    return values, errors
@@ -0,0 +1,93 @@
+"""Payment gateways and the background settlement pool.
+
+A gateway is any object with
+
+    charge(reference, amount, method, idempotency_key) -> ChargeResult
+
+that raises GatewayError for transient failures (timeouts, 5xx) worth
+retrying. ChargeResult.status is 'succeeded', 'declined' or 'processing'
+(the gateway will confirm later through the webhook). Gateways must treat a
+repeated idempotency_key as the same charge.
+
+PaymentPipeline runs `settle(payment_id)` on a thread pool so checkout never
+waits on the gateway; FakeGateway stands in for a real provider locally.
+"""
+import importlib
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+ChargeResult = namedtuple('ChargeResult', 'status reference message')
+
+
+class GatewayError(Exception):
+    """Transient gateway failure; the charge may be retried with the same idempotency key."""
+
+
+class FakeGateway:
+    """In-process gateway: optional latency, transient failures and declines, idempotent per key."""
+
+    def __init__(self, latency=0.0, fail_rate=0.0, decline_rate=0.0, seed=None):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._charges = {}
+        self._lock = threading.Lock()
+
+    def charge(self, reference, amount, method, idempotency_key):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if idempotency_key in self._charges:
+                return self._charges[idempotency_key]
+            if self._random.random() < self.fail_rate:
+                raise GatewayError('fake gateway unavailable')
+            declined = amount <= 0 or self._random.random() < self.decline_rate
+            result = ChargeResult('declined' if declined else 'succeeded', f'fake_{uuid.uuid4().hex[:16]}',
+                                  'card declined' if declined else '')
+            self._charges[idempotency_key] = result
+            return result
+
+
+def make_gateway(spec):
+    """'fake' or 'package.module:ClassName' (instantiated without arguments)."""
+    if spec == 'fake':
+        return FakeGateway()
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)()
+
+
+def backoff(attempt, base=0.5, cap=30.0):
+    """Seconds to wait before retry number `attempt` (1-based), with jitter."""
+    return min(cap, base * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+
+class PaymentPipeline:
+    """Runs `settle(payment_id)` on `workers` threads (0 = inline, for tests and the CLI)."""
+
+    def __init__(self, settle, workers=2):
+        self.settle = settle
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payments') if workers else None
+
+    def submit(self, payment_id):
+        if self._pool is None:
+            self._run(payment_id)
+            return None
+        return self._pool.submit(self._run, payment_id)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def _run(self, payment_id):
+        try:
+            self.settle(payment_id)
+        except Exception:
+            log.exception('settling payment %s failed', payment_id)
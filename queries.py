@@ -0,0 +1,71 @@
+"""Per-view eager-loading plans and a per-request SQL query budget.
+
+Views declare up front which relationships their templates walk:
+
+    queries.plan('orders', db.joinedload(Order.buyer))
+    orders = queries.load(Order.query, 'orders').filter(...).all()
+
+so a list page costs a fixed number of SELECTs instead of one per row.
+
+QueryBudget(app, default=N).install() counts the statements each request
+issues and raises QueryBudgetExceeded (an AssertionError) when a view goes
+over its budget. It is meant for tests and benchmarks, not production.
+Override the budget for a single view with @query_budget(n).
+"""
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PLANS = {}
+
+
+def plan(view, *options):
+    """Register the loader options (joinedload/selectinload/...) used by `view`."""
+    PLANS[view] = options
+
+
+def load(query, view):
+    """`query` with the eager-loading options planned for `view`."""
+    return query.options(*PLANS[view])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(n):
+    """Allow the decorated view `n` statements per request instead of the default."""
+    def deco(f):
+        f.query_budget = n
+        return f
+    return deco
+
+
+class QueryBudget:
+    def __init__(self, app, default=20):
+        self.app = app
+        self.default = default
+
+    def install(self):
+        event.listen(Engine, 'before_cursor_execute', self._count)
+        self.app.before_request(self._start)
+        self.app.after_request(self._check)
+        return self
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'budget_log' in g:
+            g.budget_log.append(' '.join(statement.split())[:200])
+
+    def _start(self):
+        g.budget_log = []
+
+    def _check(self, resp):
+        if 'budget_log' not in g:
+            return resp
+        view = self.app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', self.default)
+        if len(g.budget_log) > budget:
+            raise QueryBudgetExceeded(
+                f'{request.method} {request.path} ran {len(g.budget_log)} queries (budget {budget}):\n  '
+                + '\n  '.join(g.budget_log))
+        return resp